@@ -8,14 +8,29 @@ from sqlalchemy.dialects.postgresql import JSONB, UUID as PG_UUID
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
-from config.settings import POSTGRES_URL
+from config.settings import (
+    POSTGRES_URL,
+    POSTGRES_POOL_SIZE,
+    POSTGRES_MAX_OVERFLOW,
+    POSTGRES_POOL_RECYCLE,
+    POSTGRES_STATEMENT_CACHE_SIZE,
+)
 
-# statement_cache_size=0 is required for pgbouncer/Supavisor compatibility
-# (they don't support prepared statements in transaction mode)
+# One long-lived pool shared by every session (balance manager, ledger, routes)
+# so requests never pay the connect handshake.
+# Statement caches default to 0 for pgbouncer/Supavisor compatibility
+# (they don't support prepared statements in transaction mode); direct
+# connections can enable them with POSTGRES_STATEMENT_CACHE_SIZE.
 engine = create_async_engine(
     POSTGRES_URL, 
     echo=False,
-    connect_args={"prepared_statement_cache_size": 0, "statement_cache_size": 0}
+    pool_size=POSTGRES_POOL_SIZE,
+    max_overflow=POSTGRES_MAX_OVERFLOW,
+    pool_recycle=POSTGRES_POOL_RECYCLE,
+    connect_args={
+        "prepared_statement_cache_size": POSTGRES_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": POSTGRES_STATEMENT_CACHE_SIZE,
+    }
 )
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
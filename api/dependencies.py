@@ -1,6 +1,5 @@
 """API Dependencies - Dependency injection for FastAPI."""
 
-import redis
 from functools import lru_cache
 
 from config.settings import (
@@ -25,32 +24,25 @@ from api.services.postgres_balance_manager import PostgresBalanceManager
 from api.services.notification_service import TelegramNotificationService
 
 
-# Redis client singleton
-_redis_client = None
-
-
-def get_redis_client():
-    """Get Redis client singleton."""
-    global _redis_client
-    if _redis_client is None:
-        _redis_client = redis.from_url(REDIS_URL)
-    return _redis_client
-
-
-# Async Redis client for FastAPI dependencies
+# Async Redis client singleton; connections open lazily on first command
 import redis.asyncio as aioredis
 
 _async_redis_client = None
 
 
-async def get_redis():
-    """Get async Redis client for FastAPI dependency injection."""
+def get_async_redis_client() -> aioredis.Redis:
+    """Get async Redis client singleton."""
     global _async_redis_client
     if _async_redis_client is None:
-        _async_redis_client = await aioredis.from_url(REDIS_URL, decode_responses=True)
+        _async_redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
     return _async_redis_client
 
 
+async def get_redis():
+    """Get async Redis client for FastAPI dependency injection."""
+    return get_async_redis_client()
+
+
 # Payment engine singleton
 _payment_engine = None
 
@@ -69,7 +61,7 @@ def get_payment_engine() -> PaymentEngine:
     global _payment_engine
     
     if _payment_engine is None:
-        redis_client = get_redis_client()
+        redis_client = get_async_redis_client()
         
         # Create managers (PostgreSQL-backed for finances)
         balance_manager = PostgresBalanceManager()
@@ -108,7 +100,10 @@ def get_payment_engine() -> PaymentEngine:
             _payment_engine.register_provider(PaymentMethod.TELEGRAM_STARS, stars_provider)
         
         # Register Creem provider
-        from config.settings import CREEM_ENABLED, CREEM_API_KEY, CREEM_PRODUCT_ID, CREEM_WEBHOOK_SECRET
+        from config.settings import (
+            CREEM_ENABLED, CREEM_API_KEY, CREEM_PRODUCT_ID, CREEM_WEBHOOK_SECRET,
+            CREEM_SUCCESS_URL, CREEM_CANCEL_URL,
+        )
         if CREEM_ENABLED and CREEM_API_KEY:
             from api.services.creem_provider import CreemProvider
             creem_provider = CreemProvider(
@@ -116,6 +111,8 @@ def get_payment_engine() -> PaymentEngine:
                 product_id=CREEM_PRODUCT_ID,
                 webhook_secret=CREEM_WEBHOOK_SECRET,
                 balance_service=balance_manager,
+                success_url=CREEM_SUCCESS_URL,
+                cancel_url=CREEM_CANCEL_URL,
             )
             _payment_engine.register_provider(PaymentMethod.CREEM, creem_provider)
     
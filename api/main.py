@@ -1,4 +1,5 @@
 """FastAPI application."""
+import asyncio
 import json
 import logging
 import os
@@ -60,9 +61,19 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("BREVO_API_KEY not set, email sending disabled")
 
+    # Evict cached balances updated by other workers
+    from api.services.postgres_balance_manager import listen_for_balance_invalidations
+    balance_listener = asyncio.create_task(listen_for_balance_invalidations())
+
     yield
 
-    # Shutdown (if needed)
+    # Shutdown
+    balance_listener.cancel()
+    await payment_engine.close()
+    from api.services.payment_engine import close_paddle_clients
+    await close_paddle_clients()
+    from api.services.free_tier_service import stop_usage_flusher
+    await stop_usage_flusher()
     logger.info("Application shutting down")
 
 
@@ -15,7 +15,7 @@ async def check_auth_rate_limit():
     
     try:
         limit_key = f"auth_fail:{ip}"
-        fails = redis_client.get(limit_key)
+        fails = await redis_client.get(limit_key)
         if fails and int(fails) >= 5:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
@@ -25,7 +25,7 @@ async def check_auth_rate_limit():
         if isinstance(e, HTTPException): raise e
         # Else ignore Redis failure (Degraded)
 
-def record_auth_failure():
+async def record_auth_failure():
     """Record an authentication failure for the current IP."""
     ip = ip_address_var.get()
     if not ip:
@@ -33,9 +33,9 @@ def record_auth_failure():
     
     try:
         limit_key = f"auth_fail:{ip}"
-        fails = redis_client.incr(limit_key)
+        fails = await redis_client.incr(limit_key)
         if fails == 1:
-            redis_client.expire(limit_key, 900) # 15 minutes window
+            await redis_client.expire(limit_key, 900) # 15 minutes window
     except Exception:
         pass # Degraded
 
@@ -74,7 +74,7 @@ async def get_current_account(
         account, _ = await account_service.verify_key(x_api_key)
     
     if not account:
-        record_auth_failure()
+        await record_auth_failure()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing authentication",
@@ -98,7 +98,7 @@ async def get_current_account_and_scopes(
     account, scopes = await account_service.verify_key(x_api_key)
     
     if not account:
-        record_auth_failure()
+        await record_auth_failure()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or inactive API key",
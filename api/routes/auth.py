@@ -20,8 +20,8 @@ from fastapi import APIRouter, HTTPException, Depends, Body, Header
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.db.base import get_db, Account
-from api.services.auth_service import AuthService, TokenPair, UserInfo
+from api.db.base import get_db
+from api.services.auth_service import AccountSnapshot, AuthService, TokenPair, UserInfo
 from config.settings import REDIS_URL
 
 logger = logging.getLogger(__name__)
@@ -94,7 +94,7 @@ def _delete_refresh_token(token_hash: str) -> None:
 async def get_current_user(
     authorization: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
-) -> Account:
+) -> AccountSnapshot:
     """Dependency to get current authenticated user."""
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing authorization header")
@@ -311,7 +311,7 @@ async def logout(
 
 @router.get("/me", response_model=AccountResponse)
 async def get_current_account(
-    account: Account = Depends(get_current_user)
+    account: AccountSnapshot = Depends(get_current_user)
 ):
     """Get current authenticated user's account info."""
     return AccountResponse(
@@ -83,7 +83,7 @@ async def extract_chart(
             )
     else:
         # Anonymous: Check free tier with daily + monthly limits
-        free_tier_result = await free_tier_service.check_limit("chart2csv", client_ip)
+        free_tier_result = await free_tier_service.check_and_record("chart2csv", client_ip)
         
         if not free_tier_result.allowed:
             raise HTTPException(
@@ -121,7 +121,12 @@ async def extract_chart(
             
             result = api_response.json()
             
-    except httpx.RequestError as e:
+    except Exception as e:
+        if not account:
+            # The request produced nothing, so give the free tier units back
+            await free_tier_service.refund_usage("chart2csv", client_ip)
+        if not isinstance(e, httpx.RequestError):
+            raise
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail={"code": "SERVICE_UNAVAILABLE", "message": f"Chart2CSV service unavailable: {str(e)}"}
@@ -155,11 +160,7 @@ async def extract_chart(
             "credits_remaining": credits_remaining,
         }
     elif not account:
-        # Record free tier usage
-        await free_tier_service.record_usage("chart2csv", client_ip)
-        
-        # Get updated remaining
-        remaining = await free_tier_service.get_remaining("chart2csv", client_ip)
-        result["free_tier"] = remaining
+        # Usage was already recorded by check_and_record
+        result["free_tier"] = free_tier_result.to_remaining()
     
     return result
@@ -96,7 +96,7 @@ async def redact_pii(
             )
     else:
         # Anonymous: Check free tier
-        free_tier_result = await free_tier_service.check_limit("masker", client_ip)
+        free_tier_result = await free_tier_service.check_and_record("masker", client_ip)
 
         if not free_tier_result.allowed:
             raise HTTPException(
@@ -146,7 +146,12 @@ async def redact_pii(
 
             result = api_response.json()
 
-    except httpx.RequestError as e:
+    except Exception as e:
+        if not account:
+            # The request produced nothing, so give the free tier units back
+            await free_tier_service.refund_usage("masker", client_ip)
+        if not isinstance(e, httpx.RequestError):
+            raise
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail={"code": "SERVICE_UNAVAILABLE", "message": f"Masker service unavailable: {e}"},
@@ -179,10 +184,7 @@ async def redact_pii(
             "credits_remaining": credits_remaining,
         }
     else:
-        # Record free tier usage
-        await free_tier_service.record_usage("masker", client_ip)
-        
-        remaining = await free_tier_service.get_remaining("masker", client_ip)
-        result["free_tier"] = remaining
+        # Usage was already recorded by check_and_record
+        result["free_tier"] = free_tier_result.to_remaining()
 
     return result
@@ -118,7 +118,7 @@ async def analyze_messages(
             )
     else:
         # Anonymous: Check free tier (per message)
-        free_tier_result = await free_tier_service.check_limit("patas", client_ip, units=message_count)
+        free_tier_result = await free_tier_service.check_and_record("patas", client_ip, units=message_count)
         
         if not free_tier_result.allowed:
             raise HTTPException(
@@ -166,7 +166,12 @@ async def analyze_messages(
                 f"BLOCK: links to unknown domains",
             ]
         
-    except httpx.RequestError as e:
+    except Exception as e:
+        if not account:
+            # The request produced nothing, so give the free tier units back
+            await free_tier_service.refund_usage("patas", client_ip, units=message_count)
+        if not isinstance(e, httpx.RequestError):
+            raise
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail={"code": "SERVICE_UNAVAILABLE", "message": f"PATAS service unavailable: {e}"},
@@ -209,10 +214,7 @@ async def analyze_messages(
             "messages_analyzed": message_count,
         }
     else:
-        # Record free tier usage
-        await free_tier_service.record_usage("patas", client_ip, units=message_count)
-        
-        remaining = await free_tier_service.get_remaining("patas", client_ip)
-        result.free_tier = remaining
+        # Usage was already recorded by check_and_record
+        result.free_tier = free_tier_result.to_remaining()
     
     return result
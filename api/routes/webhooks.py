@@ -1,5 +1,6 @@
 """Webhook endpoints for payment providers."""
 
+import orjson
 from fastapi import APIRouter, HTTPException, Request, Header, status
 from typing import Optional
 
@@ -51,7 +52,7 @@ async def handle_paddle_webhook(
     
     # Parse webhook event
     try:
-        event_data = await request.json()
+        event_data = orjson.loads(body)
     except Exception as e:
         logger.error(f"Invalid JSON in Paddle webhook: {e}")
         raise HTTPException(
@@ -158,7 +159,7 @@ async def handle_lemonsqueezy_webhook(
     
     # Parse webhook event
     try:
-        event_data = await request.json()
+        event_data = orjson.loads(body)
     except Exception as e:
         logger.error(f"Invalid JSON in LemonSqueezy webhook: {e}")
         raise HTTPException(
@@ -252,7 +253,7 @@ async def handle_creem_webhook(
     
     # Parse webhook event
     try:
-        event_data = await request.json()
+        event_data = orjson.loads(body)
     except Exception as e:
         logger.error(f"Invalid JSON in Creem webhook: {e}")
         raise HTTPException(
@@ -117,7 +117,7 @@ class AccountService:
             "scopes": scopes or [],
             "key_hash": key_hash
         }
-        redis_client.set(f"api_prefix:{prefix}", json.dumps(redis_data), ex=3600*24)
+        await redis_client.set(f"api_prefix:{prefix}", json.dumps(redis_data), ex=3600*24)
         
         return raw_key
 
@@ -134,10 +134,8 @@ class AccountService:
         incoming_hash = self._hash_key(secret)
         
         # Try Redis first
-        cached_data = redis_client.get(f"api_prefix:{prefix}")
+        cached_data = await redis_client.get(f"api_prefix:{prefix}")
         if cached_data:
-            if isinstance(cached_data, bytes):
-                cached_data = cached_data.decode()
             data = json.loads(cached_data)
             if hmac.compare_digest(data["key_hash"], incoming_hash):
                 account_id = UUID(data["account_id"])
@@ -159,7 +157,7 @@ class AccountService:
                 "scopes": api_key_obj.scopes,
                 "key_hash": api_key_obj.key_hash
             }
-            redis_client.set(f"api_prefix:{prefix}", json.dumps(redis_data), ex=3600*24)
+            await redis_client.set(f"api_prefix:{prefix}", json.dumps(redis_data), ex=3600*24)
             
             stmt = select(Account).where(Account.id == api_key_obj.account_id)
             result = await self.session.execute(stmt)
@@ -184,7 +182,7 @@ class AccountService:
         if key:
             key.is_active = False
             try:
-                redis_client.delete(f"api_prefix:{prefix}")
+                await redis_client.delete(f"api_prefix:{prefix}")
             except Exception:
                 pass # Degraded cache
                 
@@ -6,14 +6,18 @@ Supports:
 - JWT access + refresh tokens
 """
 
+import base64
 import hashlib
 import hmac
 import secrets
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from typing import Optional, Tuple
 from uuid import UUID
 
 import jwt
+from cachetools import TTLCache
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -27,6 +31,17 @@ JWT_ALGORITHM = "HS256"
 JWT_ACCESS_EXPIRY_MINUTES = 15
 JWT_REFRESH_EXPIRY_DAYS = 7
 MAGIC_LINK_EXPIRY_MINUTES = 15
+TOKEN_BYTES = 32
+
+# Telegram Login Widget HMAC key: SHA-256 of the bot token
+_TELEGRAM_SECRET_KEY = (
+    hashlib.sha256(TELEGRAM_BOT_TOKEN.encode()).digest() if TELEGRAM_BOT_TOKEN else None
+)
+
+# Short-lived in-process cache for the authenticated-request account lookup.
+# Keyed by account UUID bytes; values are detached snapshots, never ORM objects.
+ACCOUNT_CACHE_TTL_SECONDS = 2
+_account_cache: TTLCache = TTLCache(maxsize=10_000, ttl=ACCOUNT_CACHE_TTL_SECONDS)
 
 
 class TokenPair(BaseModel):
@@ -44,13 +59,42 @@ class UserInfo(BaseModel):
     email: Optional[str] = None
 
 
+@dataclass(frozen=True)
+class AccountSnapshot:
+    """Read-only copy of an Account, safe to share across sessions."""
+    id: UUID
+    telegram_id: Optional[int]
+    google_id: Optional[str]
+    email: Optional[str]
+    balance_usd: Decimal
+    email_verified: bool
+    created_at: datetime
+    
+    @classmethod
+    def from_account(cls, account: Account) -> "AccountSnapshot":
+        return cls(
+            id=account.id,
+            telegram_id=account.telegram_id,
+            google_id=account.google_id,
+            email=account.email,
+            balance_usd=account.balance_usd,
+            email_verified=account.email_verified,
+            created_at=account.created_at,
+        )
+
+
 class AuthService:
     """Authentication service for dashboard access."""
     
+    @staticmethod
+    def _urlsafe_token() -> bytes:
+        """Random URL-safe token as ASCII bytes (same format as secrets.token_urlsafe)."""
+        return base64.urlsafe_b64encode(secrets.token_bytes(TOKEN_BYTES)).rstrip(b"=")
+    
     @staticmethod
     def generate_magic_token() -> str:
         """Generate a secure magic link token."""
-        return secrets.token_urlsafe(32)
+        return AuthService._urlsafe_token().decode("ascii")
     
     @staticmethod
     def create_access_token(account_id: UUID, telegram_id: Optional[int] = None) -> str:
@@ -66,10 +110,14 @@ class AuthService:
     
     @staticmethod
     def create_refresh_token(account_id: UUID) -> Tuple[str, str]:
-        """Create a refresh token and return (token, token_hash)."""
-        token = secrets.token_urlsafe(32)
-        token_hash = hashlib.sha256(token.encode()).hexdigest()
-        return token, token_hash
+        """Create a refresh token and return (token, token_hash).
+        
+        The hash is taken over the encoded bytes directly, which matches
+        hash_refresh_token() on the returned string without a str round-trip.
+        """
+        token = AuthService._urlsafe_token()
+        token_hash = hashlib.sha256(token).hexdigest()
+        return token.decode("ascii"), token_hash
     
     @staticmethod
     def hash_refresh_token(token: str) -> str:
@@ -83,6 +131,7 @@ class AuthService:
         Returns:
             Tuple of (TokenPair, refresh_token_hash for storage)
         """
+        AuthService.invalidate_account_cache(account.id)
         access_token = AuthService.create_access_token(account.id, account.telegram_id)
         refresh_token, refresh_hash = AuthService.create_refresh_token(account.id)
         
@@ -128,9 +177,9 @@ class AuthService:
             logger.error("[TG Auth] TELEGRAM_BOT_TOKEN not set!")
             return False
         
-        # Make a copy to avoid mutating original
-        data = auth_data.copy()
-        received_hash = data.pop("hash", None)
+        # Single pass: drop the hash and None values (Telegram doesn't send them)
+        received_hash = auth_data.get("hash")
+        data = {k: v for k, v in auth_data.items() if k != "hash" and v is not None}
         if not received_hash:
             logger.error("[TG Auth] No hash in auth data")
             return False
@@ -149,19 +198,14 @@ class AuthService:
                 logger.error("[TG Auth] Invalid auth_date format")
                 return False
         
-        # Filter out None values (Telegram doesn't send them)
-        data = {k: v for k, v in data.items() if v is not None}
-        
         # Create data check string
-        data_check_arr = [f"{k}={v}" for k, v in sorted(data.items())]
-        data_check_string = "\n".join(data_check_arr)
+        data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()))
         
         logger.debug(f"[TG Auth] Data check string: {data_check_string}")
         
         # Calculate expected hash
-        secret_key = hashlib.sha256(TELEGRAM_BOT_TOKEN.encode()).digest()
         expected_hash = hmac.new(
-            secret_key,
+            _TELEGRAM_SECRET_KEY,
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
@@ -240,11 +284,31 @@ class AuthService:
         return account
     
     @staticmethod
-    async def get_account_by_id(db: AsyncSession, account_id: UUID) -> Optional[Account]:
-        """Get account by ID."""
+    async def get_account_by_id(db: AsyncSession, account_id: UUID) -> Optional[AccountSnapshot]:
+        """Get account by ID.
+        
+        Hit on every authenticated request, so results are cached for
+        ACCOUNT_CACHE_TTL_SECONDS as detached snapshots.
+        """
+        key = account_id.bytes
+        snapshot = _account_cache.get(key)
+        if snapshot is not None:
+            return snapshot
+        
         stmt = select(Account).where(Account.id == account_id)
         result = await db.execute(stmt)
-        return result.scalar_one_or_none()
+        account = result.scalar_one_or_none()
+        if not account:
+            return None
+        
+        snapshot = AccountSnapshot.from_account(account)
+        _account_cache[key] = snapshot
+        return snapshot
+    
+    @staticmethod
+    def invalidate_account_cache(account_id: UUID) -> None:
+        """Drop a cached account snapshot after the account is mutated."""
+        _account_cache.pop(account_id.bytes, None)
     
     @staticmethod
     async def set_magic_link_token(db: AsyncSession, account: Account) -> str:
@@ -253,6 +317,7 @@ class AuthService:
         account.email_auth_token = token
         account.email_auth_expires = datetime.utcnow() + timedelta(minutes=MAGIC_LINK_EXPIRY_MINUTES)
         await db.commit()
+        AuthService.invalidate_account_cache(account.id)
         return token
     
     @staticmethod
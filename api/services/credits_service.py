@@ -6,9 +6,13 @@ Internally everything stays USD, this is just for display/API.
 """
 
 from decimal import Decimal, ROUND_HALF_EVEN
+from types import MappingProxyType
 
-# Conversion rate: 1000 credits = $1 USD
-CREDITS_PER_USD = 1000
+# Conversion rate: 1000 credits = $1 USD (CREDITS_PER_USD kept importable from here)
+from config.settings import CREDITS_PER_USD, USD_TO_CREDITS
+
+# USD amounts are stored to 8 decimal places
+_USD_QUANTUM = Decimal("0.00000001")
 
 
 def usd_to_credits(usd: Decimal) -> int:
@@ -23,8 +27,8 @@ def usd_to_credits(usd: Decimal) -> int:
     if usd < 0:
         raise ValueError("USD amount cannot be negative")
     
-    credits = usd * CREDITS_PER_USD
-    return int(credits.quantize(Decimal("1"), rounding=ROUND_HALF_EVEN))
+    credits = usd * USD_TO_CREDITS
+    return int(credits.to_integral_value(rounding=ROUND_HALF_EVEN))
 
 
 def credits_to_usd(credits: int) -> Decimal:
@@ -39,8 +43,8 @@ def credits_to_usd(credits: int) -> Decimal:
     if credits < 0:
         raise ValueError("Credits cannot be negative")
     
-    usd = Decimal(credits) / CREDITS_PER_USD
-    return usd.quantize(Decimal("0.00000001"), rounding=ROUND_HALF_EVEN)
+    usd = Decimal(credits) / USD_TO_CREDITS
+    return usd.quantize(_USD_QUANTUM, rounding=ROUND_HALF_EVEN)
 
 
 def format_credits(usd: Decimal) -> str:
@@ -53,8 +57,7 @@ def format_credits(usd: Decimal) -> str:
         $0.001 → "1 credit"
     """
     credits = usd_to_credits(usd)
-    formatted = f"{credits:,}"
-    return f"{formatted} {'credit' if credits == 1 else 'credits'}"
+    return f"{credits:,} {'credit' if credits == 1 else 'credits'}"
 
 
 def format_credits_cost(credits: int) -> str:
@@ -71,13 +74,13 @@ def format_credits_cost(credits: int) -> str:
     return f"{credits:,} {'credit' if credits == 1 else 'credits'}"
 
 
-# Product pricing in credits (matching spec)
-PRODUCT_CREDITS = {
+# Product pricing in credits (matching spec); read-only, values built once
+PRODUCT_CREDITS = MappingProxyType({
     "chart2csv": 50,      # $0.05 per extraction
     "masker": 1,          # $0.001 per request
     "patas": 5,           # $0.005 per 100 messages (0.05 per message)
     "reliapi": Decimal("0.1"),  # $0.0001 per request
-}
+})
 
 
 def get_product_credits(product_id: str) -> int | Decimal:
@@ -5,7 +5,6 @@ Implements PaymentProvider interface for Creem.io integration.
 Handles checkout creation, webhook verification, and payment processing.
 """
 
-import hashlib
 import hmac
 import logging
 from dataclasses import dataclass
@@ -25,8 +24,9 @@ from api.services.payment_engine import (
     WebhookEvent,
     InvalidSignatureError,
     ProviderError,
+    hmac_sha256_template,
 )
-from config.settings import CREDITS_PER_USD
+from config.settings import USD_TO_CREDITS
 
 logger = logging.getLogger(__name__)
 
@@ -48,12 +48,25 @@ class CreemProvider(PaymentProvider):
         product_id: str = None,
         webhook_secret: str = None,
         balance_service=None,
+        success_url: str = None,
+        cancel_url: str = None,
     ):
         self._api_key = api_key
         self._product_id = product_id
         self._webhook_secret = webhook_secret
+        self._hmac_template = hmac_sha256_template(webhook_secret) if webhook_secret else None
         self._balance_service = balance_service
         
+        self._success_url = success_url
+        self._cancel_url = cancel_url
+        
+        # Static part of every checkout request, built once per provider
+        self._checkout_base = {"product_id": product_id}
+        if success_url:
+            self._checkout_base["success_url"] = success_url
+        if cancel_url:
+            self._checkout_base["cancel_url"] = cancel_url
+        
         if not self._api_key:
             logger.warning("Creem API key not configured")
     
@@ -80,11 +93,11 @@ class CreemProvider(PaymentProvider):
             )
         
         # Calculate credits from USD amount
-        credits_amount = int(request.amount_usd * CREDITS_PER_USD)
+        credits_amount = int(request.amount_usd * USD_TO_CREDITS)
         
-        # Build checkout request
+        # Build checkout request from the prepared template
         checkout_data = {
-            "product_id": self._product_id,
+            **self._checkout_base,
             "metadata": {
                 "user_id": str(request.user_id),
                 "credits": credits_amount,
@@ -92,10 +105,11 @@ class CreemProvider(PaymentProvider):
             },
         }
         
-        # Add optional redirect URLs
-        if success_url:
+        # Per-call redirect URLs override the configured defaults; the usual
+        # case (the route's defaults) matches the template and copies nothing
+        if success_url and success_url != self._success_url:
             checkout_data["success_url"] = success_url
-        if cancel_url:
+        if cancel_url and cancel_url != self._cancel_url:
             checkout_data["cancel_url"] = cancel_url
         
         try:
@@ -163,18 +177,18 @@ class CreemProvider(PaymentProvider):
             return False
         
         try:
-            expected_signature = hmac.new(
-                self._webhook_secret.encode("utf-8"),
-                event.raw_body,
-                hashlib.sha256
-            ).hexdigest()
+            mac = self._hmac_template.copy()
+            mac.update(event.raw_body)
+            expected = mac.digest()
             
             # Handle signature format (may have prefix)
-            provided = event.signature
-            if provided.startswith("sha256="):
-                provided = provided[7:]
+            provided = event.signature.removeprefix("sha256=")
+            try:
+                provided_bytes = bytes.fromhex(provided)
+            except ValueError:
+                return False
             
-            return hmac.compare_digest(expected_signature, provided)
+            return hmac.compare_digest(expected, provided_bytes)
             
         except Exception as e:
             logger.error(f"Webhook signature verification error: {e}")
@@ -209,17 +223,26 @@ class CreemProvider(PaymentProvider):
         credits = metadata.get("credits")
         idempotency_key = metadata.get("idempotency_key")
         
+        # Get payment amount (Creem returns integer cents)
+        total_cents = int(payment_data.get("amount", 0) or 0)
+        
+        # Orders with several line items are folded into a single credit so
+        # the whole order costs one balance update behind one signature check
+        items = payment_data.get("items") or ()
+        if items:
+            item_cents, item_credits = self._sum_line_items(items)
+            total_cents = total_cents or item_cents
+            credits = credits or item_credits
+        
         if not user_id or not credits:
             logger.warning(f"Missing user_id or credits in webhook: {payment_id}")
             return None
         
-        # Get payment amount (Creem returns cents)
-        amount_cents = payment_data.get("amount", 0)
-        total_usd = Decimal(str(amount_cents)) / 100
-        
-        # Fallback to credits-based calculation if amount not in response
-        if total_usd == 0:
-            total_usd = Decimal(str(credits)) / CREDITS_PER_USD
+        if total_cents:
+            total_usd = Decimal(total_cents).scaleb(-2)
+        else:
+            # Fallback to credits-based calculation if amount not in response
+            total_usd = Decimal(int(credits)) / USD_TO_CREDITS
         
         logger.info(
             f"Creem payment completed: payment={payment_id}, "
@@ -236,6 +259,7 @@ class CreemProvider(PaymentProvider):
                     metadata={
                         "payment_id": payment_id,
                         "credits": credits,
+                        "items": len(items),
                         "idempotency_key": idempotency_key,
                     }
                 )
@@ -256,10 +280,21 @@ class CreemProvider(PaymentProvider):
             external_id=payment_id,
             metadata={
                 "credits": credits,
+                "items": len(items),
                 "idempotency_key": idempotency_key,
             }
         )
     
+    @staticmethod
+    def _sum_line_items(items: list) -> tuple[int, int]:
+        """Sum (amount_cents, credits) across order line items."""
+        total_cents = 0
+        total_credits = 0
+        for item in items:
+            total_cents += int(item.get("amount", 0) or 0)
+            total_credits += int((item.get("metadata") or {}).get("credits", 0) or 0)
+        return total_cents, total_credits
+    
     async def get_payment_status(self, payment_id: str) -> PaymentStatus:
         """Get payment status from Creem."""
         # Would need to query Creem API - for now return pending
@@ -5,26 +5,159 @@ Supports both authenticated (by account_id) and anonymous (by IP) tracking.
 Uses Redis for fast counter operations with automatic expiry.
 """
 
+import asyncio
 import logging
-from datetime import date, datetime
+import random
+import secrets
+import time
+from datetime import datetime, timedelta
 from typing import Optional, NamedTuple
 from decimal import Decimal
 
 import redis.asyncio as aioredis
+from cachetools import TTLCache
+from redis.exceptions import NoScriptError
 
-from config.settings import REDIS_URL
+from config.settings import FREE_TIER_ROLLING_MONTHLY, REDIS_URL
 
 logger = logging.getLogger(__name__)
 
-# Redis client for free tier tracking
-_redis_client: Optional[aioredis.Redis] = None
+# Shared Redis client for free tier tracking. from_url() does not connect,
+# so building it at import is safe; the pool is capped so bursts queue for
+# a connection instead of opening an unbounded number of sockets.
+_redis_client: aioredis.Redis = aioredis.from_url(
+    REDIS_URL,
+    decode_responses=True,
+    max_connections=64,
+    socket_keepalive=True,
+    health_check_interval=30,
+)
+
+# Counter TTLs (daily: 48h, monthly: 35 days - generous buffer)
+DAILY_KEY_TTL = 172800
+MONTHLY_KEY_TTL = 3024000
+TTL_JITTER_RATIO = 0.05  # +/-5% so keys written together don't expire together
+
+# Short-lived in-process cache of (daily, monthly) counts read by check_limit,
+# keyed by (daily_key, monthly_key) so it rolls over with the date. Writes
+# through this process refresh or drop the entry; check_and_record never
+# reads it, so enforcement always sees Redis.
+USAGE_CACHE_TTL_SECONDS = 1.0
+_usage_cache: TTLCache = TTLCache(maxsize=10_000, ttl=USAGE_CACHE_TTL_SECONDS)
+
+
+def _jittered_ttl(base: int) -> int:
+    """Spread expirations around base to avoid aligned expiry waves in Redis."""
+    spread = int(base * TTL_JITTER_RATIO)
+    return base + random.randint(-spread, spread)
+
+# Atomic check-and-increment of the daily and monthly counters.
+# KEYS: daily_key, monthly_key
+# ARGV: units, daily_limit, monthly_limit, daily_ttl, monthly_ttl
+# Returns {allowed, daily_count, monthly_count}; counters are only
+# incremented when both limits allow it, and TTLs are set on first write.
+CHECK_AND_RECORD_LUA = """
+local units = tonumber(ARGV[1])
+local d = tonumber(redis.call('GET', KEYS[1]) or '0')
+local m = tonumber(redis.call('GET', KEYS[2]) or '0')
+if d + units > tonumber(ARGV[2]) or m + units > tonumber(ARGV[3]) then
+    return {0, d, m}
+end
+local nd = redis.call('INCRBY', KEYS[1], units)
+local nm = redis.call('INCRBY', KEYS[2], units)
+if nd == units then redis.call('EXPIRE', KEYS[1], ARGV[4]) end
+if nm == units then redis.call('EXPIRE', KEYS[2], ARGV[5]) end
+return {1, nd, nm}
+"""
+
+# Unconditional increment of the daily and monthly counters.
+# KEYS: daily_key, monthly_key
+# ARGV: units, daily_ttl, monthly_ttl
+# Returns {daily_count, monthly_count}; TTLs are set on first write only.
+RECORD_USAGE_LUA = """
+local units = tonumber(ARGV[1])
+local d = redis.call('INCRBY', KEYS[1], units)
+if d == units then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+local m = redis.call('INCRBY', KEYS[2], units)
+if m == units then redis.call('EXPIRE', KEYS[2], ARGV[3]) end
+return {d, m}
+"""
+
+# Check-and-increment with the monthly limit over a rolling window.
+# Each allowed call adds a member "<now_ms>:<nonce>:<units>" to a sorted set
+# scored by time, and a running total of the units in the window is kept
+# beside it. Expired members are trimmed and their units subtracted before
+# the check, so the total never needs a full scan.
+# KEYS: daily_key, window_key, window_total_key
+# ARGV: units, daily_limit, monthly_limit, daily_ttl, now_ms, window_ms, nonce
+# Returns {allowed, daily_count, window_count}
+CHECK_AND_RECORD_ROLLING_LUA = """
+local units = tonumber(ARGV[1])
+local now = tonumber(ARGV[5])
+local window = tonumber(ARGV[6])
+local d = tonumber(redis.call('GET', KEYS[1]) or '0')
+local m = tonumber(redis.call('GET', KEYS[3]) or '0')
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now - window)
+if #expired > 0 then
+    for _, member in ipairs(expired) do
+        m = m - tonumber(string.match(member, ':(%d+)$'))
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - window)
+    redis.call('SET', KEYS[3], m, 'PX', window + 60000)
+end
+if d + units > tonumber(ARGV[2]) or m + units > tonumber(ARGV[3]) then
+    return {0, d, m}
+end
+local nd = redis.call('INCRBY', KEYS[1], units)
+if nd == units then redis.call('EXPIRE', KEYS[1], ARGV[4]) end
+redis.call('ZADD', KEYS[2], now, now .. ':' .. ARGV[7] .. ':' .. units)
+redis.call('PEXPIRE', KEYS[2], window + 60000)
+redis.call('SET', KEYS[3], m + units, 'PX', window + 60000)
+return {1, nd, m + units}
+"""
+
+# Undo a rolling-window charge: drop the newest member carrying the same
+# units and subtract it from the running total.
+# KEYS: daily_key, window_key, window_total_key
+# ARGV: units
+REFUND_ROLLING_LUA = """
+redis.call('DECRBY', KEYS[1], ARGV[1])
+local suffix = ':' .. ARGV[1]
+for _, member in ipairs(redis.call('ZREVRANGE', KEYS[2], 0, 63)) do
+    if string.sub(member, -#suffix) == suffix then
+        redis.call('ZREM', KEYS[2], member)
+        redis.call('DECRBY', KEYS[3], ARGV[1])
+        return 1
+    end
+end
+return 0
+"""
+ROLLING_WINDOW_SECONDS = 30 * 86400
+
+# Script body -> SHA1 of the script once loaded into Redis
+_SHA_CACHE: dict[str, str] = {}
+
+
+async def _invoke_script(redis: aioredis.Redis, script: str, keys: tuple, args: tuple):
+    """
+    Run a Lua script via EVALSHA so only the SHA goes over the wire.
+    
+    The script is loaded on first use; if Redis lost its script cache
+    (restart, SCRIPT FLUSH) it is reloaded and retried once.
+    """
+    sha = _SHA_CACHE.get(script)
+    if sha is None:
+        sha = _SHA_CACHE[script] = await redis.script_load(script)
+    try:
+        return await redis.evalsha(sha, len(keys), *keys, *args)
+    except NoScriptError:
+        _SHA_CACHE.pop(script, None)
+        sha = _SHA_CACHE[script] = await redis.script_load(script)
+        return await redis.evalsha(sha, len(keys), *keys, *args)
 
 
 async def get_free_tier_redis() -> aioredis.Redis:
-    """Get or create Redis client for free tier tracking."""
-    global _redis_client
-    if _redis_client is None:
-        _redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    """Get the shared Redis client for free tier tracking."""
     return _redis_client
 
 
@@ -43,6 +176,116 @@ class FreeTierResult(NamedTuple):
     limit_monthly: int
     resets_at_daily: str  # ISO datetime
     resets_at_monthly: str  # ISO datetime
+    
+    def to_remaining(self) -> dict:
+        """Format as the get_remaining() display dict without another Redis read."""
+        return {
+            "used_today": self.limit_daily - self.remaining_daily,
+            "limit_today": self.limit_daily,
+            "used_month": self.limit_monthly - self.remaining_monthly,
+            "limit_month": self.limit_monthly,
+            "resets_at": self.resets_at_daily,
+        }
+
+
+# Write-combining for record_usage on products that opt in. Increments are
+# summed in-process per (daily_key, monthly_key) and flushed as one INCRBY
+# per key every USAGE_FLUSH_INTERVAL seconds. Free tier products enforce
+# limits strictly, so none are batched by default.
+BATCHED_PRODUCTS: frozenset[str] = frozenset()
+USAGE_FLUSH_INTERVAL = 0.05
+_pending_usage: dict[tuple[str, str], int] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+async def flush_pending_usage(redis: Optional[aioredis.Redis] = None) -> None:
+    """Write accumulated usage increments to Redis in a single pipeline."""
+    global _pending_usage
+    if not _pending_usage:
+        return
+    
+    pending, _pending_usage = _pending_usage, {}
+    redis = redis or _redis_client
+    pipe = redis.pipeline(transaction=False)
+    for (daily_key, monthly_key), units in pending.items():
+        _usage_cache.pop((daily_key, monthly_key), None)
+        pipe.incrby(daily_key, units)
+        pipe.incrby(monthly_key, units)
+        # NX (Redis 7+): only a newly created counter gets a TTL
+        pipe.expire(daily_key, _jittered_ttl(DAILY_KEY_TTL), nx=True)
+        pipe.expire(monthly_key, _jittered_ttl(MONTHLY_KEY_TTL), nx=True)
+    try:
+        await pipe.execute()
+    except Exception as e:
+        # Put the increments back so the next flush retries them
+        for key, units in pending.items():
+            _pending_usage[key] = _pending_usage.get(key, 0) + units
+        logger.error(f"Failed to flush batched free tier usage: {e}")
+
+
+async def _flush_loop(redis: aioredis.Redis) -> None:
+    """Background task draining the pending usage buffer."""
+    global _flush_task
+    try:
+        while _pending_usage:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            await flush_pending_usage(redis)
+    finally:
+        _flush_task = None
+
+
+async def stop_usage_flusher() -> None:
+    """Stop the background flush task and write out whatever it left pending."""
+    global _flush_task
+    task, _flush_task = _flush_task, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await flush_pending_usage()
+
+
+def _pending_units(daily_key: str, monthly_key: str) -> int:
+    """Units recorded in-process but not yet flushed to Redis."""
+    return _pending_usage.get((daily_key, monthly_key), 0)
+
+
+def _build_monthly_resets(months: int = 24) -> dict[tuple[int, int], str]:
+    """Map (year, month) to the ISO reset time of that month's counter, i.e. the 1st of the next month."""
+    now = datetime.utcnow()
+    resets = {}
+    for offset in range(months + 1):
+        year, month = divmod(now.month - 1 + offset, 12)
+        year += now.year
+        next_year, next_month = divmod(month + 1, 12)
+        resets[(year, month + 1)] = f"{year + next_year:04d}-{next_month + 1:02d}-01T00:00:00Z"
+    return resets
+
+
+# Monthly reset times for the next 24 months, computed once at import
+_MONTHLY_RESETS = _build_monthly_resets()
+
+# Date strings used in keys and reset times, recomputed once per UTC day
+_DATE_CACHE = {"day": "", "month": "", "reset_daily": "", "reset_monthly": "", "expires": 0.0}
+
+
+def _refresh_date_cache() -> dict:
+    """Return the cached date strings, recomputing them when the UTC day rolls over."""
+    now = time.time()
+    if now >= _DATE_CACHE["expires"]:
+        today = datetime.utcfromtimestamp(now)
+        reset_monthly = _MONTHLY_RESETS.get((today.year, today.month))
+        if reset_monthly is None:  # process outlived the precomputed table
+            _MONTHLY_RESETS.update(_build_monthly_resets())
+            reset_monthly = _MONTHLY_RESETS[(today.year, today.month)]
+        _DATE_CACHE["day"] = today.strftime("%Y-%m-%d")
+        _DATE_CACHE["month"] = today.strftime("%Y-%m")
+        _DATE_CACHE["reset_daily"] = (today.date() + timedelta(days=1)).isoformat() + "T00:00:00Z"
+        _DATE_CACHE["reset_monthly"] = reset_monthly
+        _DATE_CACHE["expires"] = now - now % 86400 + 86400  # next UTC midnight
+    return _DATE_CACHE
 
 
 # Free tier limits per product (from spec)
@@ -54,9 +297,31 @@ FREE_TIER_LIMITS: dict[str, FreeTierLimits] = {
 }
 
 
+# Identifiers per MGET in get_many_remaining (8 keys each with 4 products)
+MANY_REMAINING_CHUNK = 500
+
+# Limits for products missing from FREE_TIER_LIMITS
+DEFAULT_FREE_TIER_LIMITS = FreeTierLimits(daily=10, monthly=100)
+
 # Progressive limits configuration
 PROGRESSIVE_LIMIT_DAYS = 7  # First 7 days = reduced limits
 PROGRESSIVE_LIMIT_MULTIPLIER = 0.5  # 50% of normal limits
+PROGRESSIVE_CHECK_TTL = 60  # Seconds to reuse an _is_in_progressive_period() result
+
+
+def _progressive_limits(limits: FreeTierLimits) -> FreeTierLimits:
+    """Apply the progressive reduction for new users, minimum 1."""
+    return FreeTierLimits(
+        daily=max(1, int(limits.daily * PROGRESSIVE_LIMIT_MULTIPLIER)),
+        monthly=max(1, int(limits.monthly * PROGRESSIVE_LIMIT_MULTIPLIER)),
+    )
+
+
+# Reduced limits precomputed once so _get_limits is a single dict lookup
+_PROGRESSIVE_LIMITS: dict[str, FreeTierLimits] = {
+    product_id: _progressive_limits(limits) for product_id, limits in FREE_TIER_LIMITS.items()
+}
+_PROGRESSIVE_DEFAULT_LIMITS = _progressive_limits(DEFAULT_FREE_TIER_LIMITS)
 
 
 class FreeTierService:
@@ -67,44 +332,42 @@ class FreeTierService:
     
     Usage:
         service = FreeTierService()
-        result = await service.check_limit("chart2csv", identifier="1.2.3.4")
-        if result.allowed:
-            await service.record_usage("chart2csv", identifier="1.2.3.4")
+        result = await service.check_and_record("chart2csv", identifier="1.2.3.4")
+        if not result.allowed:
+            ...  # limit exceeded, nothing was recorded
     """
     
     def __init__(self, redis: Optional[aioredis.Redis] = None):
         self._redis = redis
         self._account_started_at: Optional[datetime] = None
+        self._progressive: Optional[bool] = None
+        self._progressive_checked_at = 0.0
     
     def set_account_started_at(self, started_at: Optional[datetime]) -> None:
         """Set account start date for progressive limits calculation."""
         self._account_started_at = started_at
+        self._progressive = None
     
-    async def _get_redis(self) -> aioredis.Redis:
-        if self._redis:
-            return self._redis
-        return await get_free_tier_redis()
+    def _get_redis(self) -> aioredis.Redis:
+        return self._redis or _redis_client
     
     def _is_in_progressive_period(self) -> bool:
         """Check if account is within progressive (reduced) limits period."""
         if not self._account_started_at:
             return False
         
-        days_since_start = (datetime.utcnow() - self._account_started_at).days
-        return days_since_start < PROGRESSIVE_LIMIT_DAYS
+        now = time.monotonic()
+        if self._progressive is None or now - self._progressive_checked_at > PROGRESSIVE_CHECK_TTL:
+            days_since_start = (datetime.utcnow() - self._account_started_at).days
+            self._progressive = days_since_start < PROGRESSIVE_LIMIT_DAYS
+            self._progressive_checked_at = now
+        return self._progressive
     
     def _get_limits(self, product_id: str) -> FreeTierLimits:
         """Get limits for a product, applying progressive reduction if applicable."""
-        base_limits = FREE_TIER_LIMITS.get(product_id, FreeTierLimits(daily=10, monthly=100))
-        
         if self._is_in_progressive_period():
-            # Apply 50% reduction for new users, minimum 1
-            return FreeTierLimits(
-                daily=max(1, int(base_limits.daily * PROGRESSIVE_LIMIT_MULTIPLIER)),
-                monthly=max(1, int(base_limits.monthly * PROGRESSIVE_LIMIT_MULTIPLIER))
-            )
-        
-        return base_limits
+            return _PROGRESSIVE_LIMITS.get(product_id, _PROGRESSIVE_DEFAULT_LIMITS)
+        return FREE_TIER_LIMITS.get(product_id, DEFAULT_FREE_TIER_LIMITS)
     
     def get_progressive_status(self) -> dict:
         """Get progressive limits status for display."""
@@ -125,27 +388,19 @@ class FreeTierService:
     
     def _daily_key(self, product_id: str, identifier: str) -> str:
         """Redis key for daily counter."""
-        today = date.today().isoformat()
-        return f"free:{product_id}:{identifier}:daily:{today}"
+        return "free:%s:%s:daily:%s" % (product_id, identifier, _refresh_date_cache()["day"])
     
     def _monthly_key(self, product_id: str, identifier: str) -> str:
         """Redis key for monthly counter."""
-        month = datetime.utcnow().strftime("%Y-%m")
-        return f"free:{product_id}:{identifier}:monthly:{month}"
+        return "free:%s:%s:monthly:%s" % (product_id, identifier, _refresh_date_cache()["month"])
     
     def _daily_reset_time(self) -> str:
         """ISO datetime when daily limit resets (next midnight UTC)."""
-        tomorrow = date.today().isoformat()
-        return f"{tomorrow}T00:00:00Z"
+        return _refresh_date_cache()["reset_daily"]
     
     def _monthly_reset_time(self) -> str:
         """ISO datetime when monthly limit resets (first of next month UTC)."""
-        now = datetime.utcnow()
-        if now.month == 12:
-            next_month = now.replace(year=now.year + 1, month=1, day=1)
-        else:
-            next_month = now.replace(month=now.month + 1, day=1)
-        return next_month.strftime("%Y-%m-%dT00:00:00Z")
+        return _refresh_date_cache()["reset_monthly"]
     
     async def check_limit(
         self,
@@ -164,34 +419,31 @@ class FreeTierService:
         Returns:
             FreeTierResult with allowed status and remaining limits
         """
-        redis = await self._get_redis()
-        limits = self._get_limits(product_id)
+        redis = self._get_redis()
+        # Unpack the limits tuple once instead of repeated NamedTuple attribute reads
+        limit_daily, limit_monthly = self._get_limits(product_id)
         
         daily_key = self._daily_key(product_id, identifier)
         monthly_key = self._monthly_key(product_id, identifier)
         
-        # Get current counts
-        daily_count = await redis.get(daily_key)
-        monthly_count = await redis.get(monthly_key)
+        # Get current counts in one round trip, unless read within the last second
+        cache_key = (daily_key, monthly_key)
+        counts = _usage_cache.get(cache_key)
+        if counts is None:
+            daily_count, monthly_count = await redis.mget(daily_key, monthly_key)
+            counts = _usage_cache[cache_key] = (int(daily_count or 0), int(monthly_count or 0))
         
-        daily_used = int(daily_count) if daily_count else 0
-        monthly_used = int(monthly_count) if monthly_count else 0
-        
-        remaining_daily = max(0, limits.daily - daily_used)
-        remaining_monthly = max(0, limits.monthly - monthly_used)
-        
-        # Check if allowed
-        allowed = (
-            daily_used + units <= limits.daily and
-            monthly_used + units <= limits.monthly
-        )
+        # Include batched increments that have not been flushed yet
+        pending = _pending_units(daily_key, monthly_key)
+        remaining_daily = limit_daily - counts[0] - pending
+        remaining_monthly = limit_monthly - counts[1] - pending
         
         return FreeTierResult(
-            allowed=allowed,
-            remaining_daily=remaining_daily,
-            remaining_monthly=remaining_monthly,
-            limit_daily=limits.daily,
-            limit_monthly=limits.monthly,
+            allowed=remaining_daily >= units and remaining_monthly >= units,
+            remaining_daily=max(0, remaining_daily),
+            remaining_monthly=max(0, remaining_monthly),
+            limit_daily=limit_daily,
+            limit_monthly=limit_monthly,
             resets_at_daily=self._daily_reset_time(),
             resets_at_monthly=self._monthly_reset_time(),
         )
@@ -205,26 +457,150 @@ class FreeTierService:
         """
         Record usage and increment counters.
         
+        Products in BATCHED_PRODUCTS are write-combined in-process; for
+        those the returned counts are the pending (unflushed) units only.
+        
         Returns:
             Tuple of (new_daily_count, new_monthly_count)
         """
-        redis = await self._get_redis()
+        global _flush_task
+        redis = self._get_redis()
         
         daily_key = self._daily_key(product_id, identifier)
         monthly_key = self._monthly_key(product_id, identifier)
         
-        # Increment with pipeline for atomicity
-        pipe = redis.pipeline()
-        pipe.incrby(daily_key, units)
-        pipe.incrby(monthly_key, units)
+        if product_id in BATCHED_PRODUCTS:
+            key = (daily_key, monthly_key)
+            pending = _pending_usage.get(key, 0) + units
+            _pending_usage[key] = pending
+            if _flush_task is None:
+                _flush_task = asyncio.create_task(_flush_loop(redis))
+            return pending, pending
         
-        # Set expiry (daily: 48h, monthly: 35 days - generous buffer)
-        pipe.expire(daily_key, 172800)  # 48 hours
-        pipe.expire(monthly_key, 3024000)  # 35 days
+        daily_count, monthly_count = await _invoke_script(
+            redis,
+            RECORD_USAGE_LUA,
+            (daily_key, monthly_key),
+            (units, _jittered_ttl(DAILY_KEY_TTL), _jittered_ttl(MONTHLY_KEY_TTL)),
+        )
+        _usage_cache[(daily_key, monthly_key)] = (daily_count, monthly_count)
+        return daily_count, monthly_count
+    
+    async def check_and_record(
+        self,
+        product_id: str,
+        identifier: str,
+        units: int = 1
+    ) -> FreeTierResult:
+        """
+        Atomically check limits and record usage in one Redis round trip.
+        
+        Unlike check_limit() followed by record_usage(), concurrent callers
+        cannot both pass the check and overshoot the limit. Usage is only
+        recorded when the result is allowed.
+        """
+        redis = self._get_redis()
+        limits = self._get_limits(product_id)
+        
+        if FREE_TIER_ROLLING_MONTHLY:
+            return await self._check_and_record_rolling(redis, limits, product_id, identifier, units)
+        
+        keys = (
+            self._daily_key(product_id, identifier),
+            self._monthly_key(product_id, identifier),
+        )
+        args = (
+            units,
+            limits.daily,
+            limits.monthly,
+            _jittered_ttl(DAILY_KEY_TTL),
+            _jittered_ttl(MONTHLY_KEY_TTL),
+        )
         
-        results = await pipe.execute()
+        allowed, daily_used, monthly_used = await _invoke_script(
+            redis, CHECK_AND_RECORD_LUA, keys, args
+        )
+        _usage_cache[keys] = (daily_used, monthly_used)
         
-        return int(results[0]), int(results[1])
+        return FreeTierResult(
+            allowed=bool(allowed),
+            remaining_daily=max(0, limits.daily - daily_used),
+            remaining_monthly=max(0, limits.monthly - monthly_used),
+            limit_daily=limits.daily,
+            limit_monthly=limits.monthly,
+            resets_at_daily=self._daily_reset_time(),
+            resets_at_monthly=self._monthly_reset_time(),
+        )
+    
+    async def refund_usage(
+        self,
+        product_id: str,
+        identifier: str,
+        units: int = 1
+    ) -> None:
+        """
+        Give back units recorded by check_and_record() for a request that failed.
+        
+        Best effort: a Redis error is logged rather than raised so it cannot
+        mask the upstream failure being reported to the caller.
+        """
+        redis = self._get_redis()
+        try:
+            if FREE_TIER_ROLLING_MONTHLY:
+                keys = self._rolling_keys(product_id, identifier)
+                await _invoke_script(redis, REFUND_ROLLING_LUA, keys, (units,))
+                return
+            
+            daily_key = self._daily_key(product_id, identifier)
+            monthly_key = self._monthly_key(product_id, identifier)
+            _usage_cache.pop((daily_key, monthly_key), None)
+            pipe = redis.pipeline(transaction=False)
+            pipe.decrby(daily_key, units)
+            pipe.decrby(monthly_key, units)
+            await pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to refund free tier usage for {product_id}: {e}")
+    
+    def _rolling_keys(self, product_id: str, identifier: str) -> tuple[str, str, str]:
+        """Redis keys for the daily counter and the rolling monthly window."""
+        window_key = "free:%s:%s:rolling" % (product_id, identifier)
+        return self._daily_key(product_id, identifier), window_key, window_key + ":total"
+    
+    async def _check_and_record_rolling(
+        self,
+        redis: aioredis.Redis,
+        limits: FreeTierLimits,
+        product_id: str,
+        identifier: str,
+        units: int,
+    ) -> FreeTierResult:
+        """
+        check_and_record() with the monthly limit applied to the last
+        ROLLING_WINDOW_SECONDS, so a user who hits it late in a month is
+        not locked out until the month rolls over.
+        """
+        args = (
+            units,
+            limits.daily,
+            limits.monthly,
+            _jittered_ttl(DAILY_KEY_TTL),
+            int(time.time() * 1000),
+            ROLLING_WINDOW_SECONDS * 1000,
+            secrets.token_hex(4),  # distinct member for same-millisecond requests
+        )
+        allowed, daily_used, window_used = await _invoke_script(
+            redis, CHECK_AND_RECORD_ROLLING_LUA, self._rolling_keys(product_id, identifier), args
+        )
+        
+        return FreeTierResult(
+            allowed=bool(allowed),
+            remaining_daily=max(0, limits.daily - daily_used),
+            remaining_monthly=max(0, limits.monthly - window_used),
+            limit_daily=limits.daily,
+            limit_monthly=limits.monthly,
+            resets_at_daily=self._daily_reset_time(),
+            resets_at_monthly=self._monthly_reset_time(),
+        )
     
     async def get_remaining(
         self,
@@ -242,19 +618,50 @@ class FreeTierService:
             - resets_at
         """
         result = await self.check_limit(product_id, identifier, units=0)
-        limits = self._get_limits(product_id)
+        return result.to_remaining()
+    
+    async def get_many_remaining(self, identifiers: list[str]) -> dict[str, dict[str, dict]]:
+        """
+        Get remaining limits for all products across many identifiers.
         
-        return {
-            "used_today": limits.daily - result.remaining_daily,
-            "limit_today": limits.daily,
-            "used_month": limits.monthly - result.remaining_monthly,
-            "limit_month": limits.monthly,
-            "resets_at": result.resets_at_daily,
-        }
+        Issues one MGET per MANY_REMAINING_CHUNK identifiers instead of a
+        round trip per key, while keeping each MGET short enough not to
+        stall other Redis clients.
+        
+        Returns:
+            {identifier: {product_id: {used_today, limit_today, ...}}}
+        """
+        redis = self._get_redis()
+        products = tuple(FREE_TIER_LIMITS)
+        per_identifier = 2 * len(products)
+        resets_at = self._daily_reset_time()
+        
+        result = {}
+        for start in range(0, len(identifiers), MANY_REMAINING_CHUNK):
+            chunk = identifiers[start:start + MANY_REMAINING_CHUNK]
+            keys = []
+            for identifier in chunk:
+                keys += [self._daily_key(p, identifier) for p in products]
+                keys += [self._monthly_key(p, identifier) for p in products]
+            values = await redis.mget(keys)
+            
+            for index, identifier in enumerate(chunk):
+                offset = index * per_identifier
+                daily_values = values[offset:offset + len(products)]
+                monthly_values = values[offset + len(products):offset + per_identifier]
+                status = {}
+                for product_id, daily_count, monthly_count in zip(products, daily_values, monthly_values):
+                    limits = self._get_limits(product_id)
+                    status[product_id] = {
+                        "used_today": min(limits.daily, int(daily_count or 0)),
+                        "limit_today": limits.daily,
+                        "used_month": min(limits.monthly, int(monthly_count or 0)),
+                        "limit_month": limits.monthly,
+                        "resets_at": resets_at,
+                    }
+                result[identifier] = status
+        return result
     
     async def get_all_remaining(self, identifier: str) -> dict[str, dict]:
-        """Get remaining limits for all products."""
-        return {
-            product_id: await self.get_remaining(product_id, identifier)
-            for product_id in FREE_TIER_LIMITS.keys()
-        }
+        """Get remaining limits for all products in a single MGET."""
+        return (await self.get_many_remaining([identifier]))[identifier]
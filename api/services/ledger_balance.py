@@ -1,28 +1,176 @@
 import json
-import redis
+import logging
+import threading
+import redis.asyncio as aioredis
 from decimal import Decimal, ROUND_HALF_EVEN, getcontext
 from datetime import datetime
-from typing import Optional, List
-from uuid import UUID
+from typing import Optional, List, Union
+from uuid import UUID, uuid4
 
-from sqlalchemy import select, update
+from sqlalchemy import select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from api.db.base import Account, Transaction, UsageLog, APIKey, Product
 from config.settings import REDIS_URL
 
-# Redis client for balance caching
-redis_client = redis.from_url(REDIS_URL)
+logger = logging.getLogger(__name__)
+
+# Async Redis client for balance caching (shared with account/auth services)
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+BALANCE_CACHE_TTL = 3600  # Seconds; refreshed on every cached read
 
 # Set precision context globally for financial calculations
 getcontext().prec = 28 # Sufficient for (18, 8) math
 
-# Circuit Breaker state (Global to the service instance)
-_redis_cb_state = {"status": "CLOSED", "last_failure": 0.0, "failure_count": 0}
+# Ledger amounts are NUMERIC(18, 8); the balance cache stores integer units of 1e-8 USD
+SATOSHI_PER_USD = 10 ** 8
+USD_QUANTUM = Decimal("0.00000001")
+
+
+def to_satoshi(amount) -> int:
+    """Convert a USD amount to integer 1e-8 units with Banker's Rounding."""
+    if isinstance(amount, int):
+        return amount * SATOSHI_PER_USD
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int(amount.scaleb(8).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_satoshi(value: int) -> Decimal:
+    """Convert integer 1e-8 units back to a Decimal USD amount."""
+    return Decimal(value).scaleb(-8)
+
+
 REDIS_CB_THRESHOLD = 5
 REDIS_CB_RECOVERY_TIME = 60 # Seconds
 
+
+class _CircuitBreaker:
+    """Redis circuit breaker whose state transitions are serialized by a lock."""
+
+    def __init__(self, threshold: int, recovery_time: float):
+        self.threshold = threshold
+        self.recovery_time = recovery_time
+        self.status = "CLOSED"
+        self.last_failure = 0.0
+        self.failure_count = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if the breaker allows Redis calls (moves OPEN -> HALF_OPEN after recovery)."""
+        with self._lock:
+            if self.status == "OPEN":
+                if (datetime.utcnow().timestamp() - self.last_failure) > self.recovery_time:
+                    self.status = "HALF_OPEN"
+                    return True
+                return False
+            return True
+
+    def record_failure(self, e) -> None:
+        """Count a failure and trip the breaker once the threshold is reached."""
+        with self._lock:
+            self.failure_count += 1
+            self.last_failure = datetime.utcnow().timestamp()
+            tripped = self.failure_count >= self.threshold and self.status != "OPEN"
+            if self.failure_count >= self.threshold:
+                self.status = "OPEN"
+        if tripped:
+            logger.critical(f"Redis Circuit Breaker TRIP! Status: OPEN. Error: {e}")
+
+    def record_success(self) -> None:
+        """Reset the breaker after a successful call."""
+        with self._lock:
+            self.failure_count = 0
+            self.status = "CLOSED"
+
+
+# Circuit Breaker state (Global to the service instance)
+_redis_breaker = _CircuitBreaker(REDIS_CB_THRESHOLD, REDIS_CB_RECOVERY_TIME)
+
+# Single round trip for record_usage:
+# - claimed: the idempotency key was new and the transaction row was inserted
+# - new_balance: NULL when the balance did not cover the cost
+# - current_balance: balance before this statement (returned for retries)
+RECORD_USAGE_SQL = text("""
+WITH acct AS (
+    SELECT id, balance_usd, auto_recharge_threshold
+    FROM accounts
+    WHERE telegram_id = :telegram_id
+),
+ins_t AS (
+    INSERT INTO transactions (id, account_id, amount_usd, type, product_id, idempotency_key, description, created_at)
+    SELECT CAST(:tx_id AS UUID), acct.id, -CAST(:cost AS NUMERIC), 'usage', :product_id,
+           :idempotency_key, :description, now()
+    FROM acct
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING account_id
+),
+upd AS (
+    UPDATE accounts
+    SET balance_usd = balance_usd - CAST(:cost AS NUMERIC)
+    WHERE id = (SELECT account_id FROM ins_t) AND balance_usd >= CAST(:cost AS NUMERIC)
+    RETURNING id, balance_usd
+),
+ins_u AS (
+    INSERT INTO usage_logs (id, account_id, product_id, units_consumed, cost_usd, metadata_json, timestamp)
+    SELECT CAST(:log_id AS UUID), upd.id, :product_id, CAST(:units AS INTEGER),
+           CAST(:cost AS NUMERIC), CAST(:metadata AS JSONB), now()
+    FROM upd
+)
+SELECT
+    (SELECT id FROM acct) AS account_id,
+    EXISTS (SELECT 1 FROM ins_t) AS claimed,
+    (SELECT balance_usd FROM upd) AS new_balance,
+    (SELECT balance_usd FROM acct) AS current_balance,
+    (SELECT auto_recharge_threshold FROM acct) AS auto_recharge_threshold
+""")
+
+# Creates missing accounts for add_funds_many (add_funds creates them via the ORM)
+ENSURE_ACCOUNTS_SQL = text("""
+INSERT INTO accounts (id, telegram_id, balance_usd, opt_in_debug, email_verified,
+                      free_tier_started_at, created_at, last_active_at)
+SELECT gen_random_uuid(), t.telegram_id, 0, false, false, now(), now(), now()
+FROM unnest(CAST(:telegram_ids AS BIGINT[])) AS t(telegram_id)
+ON CONFLICT (telegram_id) DO NOTHING
+""")
+
+# Batched top-ups: one multi-row transactions INSERT (duplicates skipped by
+# the idempotency_key constraint) and one UPDATE ... FROM the per-account
+# sums of the rows that were actually inserted.
+ADD_FUNDS_MANY_SQL = text("""
+WITH input AS (
+    SELECT *
+    FROM unnest(
+        CAST(:telegram_ids AS BIGINT[]),
+        CAST(:amounts AS NUMERIC[]),
+        CAST(:idempotency_keys AS TEXT[]),
+        CAST(:descriptions AS TEXT[]),
+        CAST(:tx_ids AS UUID[])
+    ) AS t(telegram_id, amount, idempotency_key, description, tx_id)
+),
+ins_t AS (
+    INSERT INTO transactions (id, account_id, amount_usd, type, idempotency_key, description, created_at)
+    SELECT input.tx_id, a.id, input.amount, 'topup', input.idempotency_key, input.description, now()
+    FROM input JOIN accounts a ON a.telegram_id = input.telegram_id
+    ON CONFLICT (idempotency_key) DO NOTHING
+    RETURNING account_id, idempotency_key, amount_usd
+),
+upd AS (
+    UPDATE accounts
+    SET balance_usd = accounts.balance_usd + totals.amount
+    FROM (
+        SELECT account_id, SUM(amount_usd) AS amount
+        FROM ins_t
+        GROUP BY account_id
+    ) AS totals
+    WHERE accounts.id = totals.account_id
+    RETURNING accounts.id, accounts.telegram_id, accounts.balance_usd
+)
+SELECT ins_t.idempotency_key, upd.telegram_id, upd.balance_usd
+FROM ins_t JOIN upd ON upd.id = ins_t.account_id
+""")
+
 class LedgerBalanceService:
     """PostgreSQL-based ledger for financial transactions and usage tracking."""
     
@@ -43,7 +191,7 @@ class LedgerBalanceService:
             self.session.add(account)
             await self.session.flush()
             # Cache initial balance in Redis
-            self._cache_balance(telegram_id, account.balance_usd)
+            await self._cache_balance(telegram_id, account.balance_usd)
             
         return account
 
@@ -54,33 +202,66 @@ class LedgerBalanceService:
         idempotency_key: str, 
         description: str = "Top up"
     ) -> Decimal:
-        """Add funds to account via a transaction ledger entry."""
-        account = await self.get_account_by_tg_id(telegram_id, for_update=True)
-        
-        # Ensure input amount is Decimal
-        amount_dec = Decimal(str(amount))
+        """
+        Add funds to account via a transaction ledger entry.
         
-        # Create transaction record
-        tx = Transaction(
-            account_id=account.id,
-            amount_usd=amount_dec,
-            type="topup",
-            idempotency_key=idempotency_key,
-            description=description
+        Runs the add_funds_many statements for a single entry, so the ledger
+        row and the balance update are written by one CTE instead of a
+        locked read followed by ORM INSERT and UPDATE round trips.
+        """
+        (result,) = await self.add_funds_many(
+            [(telegram_id, Decimal(str(amount)), idempotency_key, description)]
         )
-        self.session.add(tx)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def add_funds_many(
+        self,
+        entries: List[tuple[int, Decimal, str, str]],
+        commit: bool = True,
+    ) -> List[Union[Decimal, Exception]]:
+        """
+        Add funds for several (telegram_id, amount, idempotency_key, description)
+        entries in two statements (see ENSURE_ACCOUNTS_SQL / ADD_FUNDS_MANY_SQL).
         
-        # Update account balance
-        account.balance_usd += amount_dec
+        Entries whose idempotency key was already used get a ValueError; the
+        rest get their account's balance after the whole batch. Pass
+        commit=False when the caller owns the session's transaction.
+        """
+        unique_entries = list({entry[2]: entry for entry in entries}.values())
+        telegram_ids = [entry[0] for entry in unique_entries]
         
-        try:
+        await self.session.execute(
+            ENSURE_ACCOUNTS_SQL,
+            {"telegram_ids": sorted(set(telegram_ids))},
+        )
+        result = await self.session.execute(
+            ADD_FUNDS_MANY_SQL,
+            {
+                "telegram_ids": telegram_ids,
+                "amounts": [entry[1] for entry in unique_entries],
+                "idempotency_keys": [entry[2] for entry in unique_entries],
+                "descriptions": [entry[3] for entry in unique_entries],
+                "tx_ids": [uuid4() for _ in unique_entries],
+            },
+        )
+        credited = {row.idempotency_key: (row.telegram_id, row.balance_usd) for row in result.all()}
+        
+        if commit:
             await self.session.commit()
-            # Update Redis cache
-            self._cache_balance(telegram_id, account.balance_usd)
-            return account.balance_usd
-        except IntegrityError:
-            await self.session.rollback()
-            raise ValueError(f"Transaction {idempotency_key} already processed.")
+            for telegram_id, balance in set(credited.values()):
+                await self._cache_balance(telegram_id, balance)
+        
+        results: List[Union[Decimal, Exception]] = []
+        seen = set()
+        for _, _, idempotency_key, _ in entries:
+            if idempotency_key in credited and idempotency_key not in seen:
+                results.append(credited[idempotency_key][1])
+            else:
+                results.append(ValueError(f"Transaction {idempotency_key} already processed."))
+            seen.add(idempotency_key)
+        return results
 
     async def record_usage(
         self,
@@ -94,110 +275,93 @@ class LedgerBalanceService:
         """
         Record product usage and deduct cost from balance with strict idempotency.
         Enforces 8-decimal precision and Banker's Rounding.
-        Uses row-level locking (FOR UPDATE) to prevent race conditions.
+        
+        The idempotency claim, balance check/deduction and both ledger inserts
+        run as one statement (see RECORD_USAGE_SQL). The conditional UPDATE
+        takes the row lock, so no SELECT ... FOR UPDATE is needed.
         """
-        # 1. First check if this specific usage event was already processed (Postgres-level idempotency)
-        stmt_tx = select(Transaction).where(Transaction.idempotency_key == idempotency_key)
-        tx_result = await self.session.execute(stmt_tx)
-        if tx_result.scalar_one_or_none():
-            account = await self.get_account_by_tg_id(telegram_id)
-            return account.balance_usd if account else Decimal("0.00000000")
+        # Enforce Banker's Rounding to 8 decimal places (the only rounding on this path)
+        if not isinstance(cost, Decimal):
+            cost = Decimal(str(cost))
+        cost_dec = cost.quantize(USD_QUANTUM, rounding=ROUND_HALF_EVEN)
 
-        # 2. Lock account row for update
-        account = await self.get_account_by_tg_id(telegram_id, for_update=True)
-        if not account:
+        result = await self.session.execute(
+            RECORD_USAGE_SQL,
+            {
+                "telegram_id": telegram_id,
+                "tx_id": uuid4(),
+                "log_id": uuid4(),
+                "cost": cost_dec,
+                "units": units,
+                "product_id": product_id,
+                "idempotency_key": idempotency_key,
+                "description": f"Usage: {product_id} ({units} units)",
+                "metadata": json.dumps(metadata) if metadata is not None else None,
+            },
+        )
+        row = result.one()
+
+        if row.account_id is None:
+            await self.session.rollback()
             raise ValueError("Account not found", "ACCOUNT_NOT_FOUND")
 
-        # 3. Enforce Banker's Rounding to 8 decimal places
-        cost_dec = Decimal(str(cost)).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_EVEN)
-        
-        if account.balance_usd < cost_dec:
-            # Check for auto-recharge before failing
-            if account.auto_recharge_threshold and account.auto_recharge_amount:
-                # This would typically trigger a background payment process or notification
-                # For Phase 4, we mark it in metadata but still stop if balance < cost
-                pass
+        if not row.claimed:
+            # Usage event already processed
+            await self.session.rollback()
+            return row.current_balance
+
+        if row.new_balance is None:
+            # Rolls back the transaction row claimed above
+            await self.session.rollback()
             raise ValueError("Insufficient balance (Prepaid Hard-Stop)", "BALANCE_EXHAUSTED")
 
-        # 4. Record usage log
-        usage = UsageLog(
-            account_id=account.id,
-            product_id=product_id,
-            units_consumed=units,
-            cost_usd=cost_dec,
-            metadata_json=metadata
-        )
-        self.session.add(usage)
-        
-        # 5. Deduct from balance
-        account.balance_usd -= cost_dec
-        
-        # 6. Record as a transaction for the ledger
-        tx = Transaction(
-            account_id=account.id,
-            amount_usd=-cost_dec,
-            type="usage",
-            product_id=product_id,
-            idempotency_key=idempotency_key,
-            description=f"Usage: {product_id} ({units} units)"
-        )
-        self.session.add(tx)
-        
         try:
             await self.session.commit()
-            
-            # 7. Auto-recharge check (Post-usage)
-            if account.auto_recharge_threshold and account.balance_usd <= account.auto_recharge_threshold:
-                # Trigger internal event (handled by bot/scheduler later)
-                # For now, we just log it in AuditLog
-                from api.services.account_service import AccountService
-                svc = AccountService(self.session)
-                await svc.record_audit(
-                    account.id, 
-                    "AUTO_RECHARGE_TRIGGERED", 
-                    metadata={"balance": str(account.balance_usd), "threshold": str(account.auto_recharge_threshold)}
-                )
-
-            # 8. Update Redis cache with Circuit Breaker
-            if self._is_redis_open():
-                try:
-                    self._cache_balance(telegram_id, account.balance_usd)
-                    self._redis_success()
-                except Exception as e:
-                    self._redis_failure(e)
-            
-            return account.balance_usd
         except IntegrityError:
             await self.session.rollback()
             account = await self.get_account_by_tg_id(telegram_id)
             return account.balance_usd if account else Decimal("0.00000000")
 
+        new_balance = row.new_balance
+
+        # Auto-recharge check (Post-usage)
+        if row.auto_recharge_threshold and new_balance <= row.auto_recharge_threshold:
+            # Trigger internal event (handled by bot/scheduler later)
+            # For now, we just log it in AuditLog
+            from api.services.account_service import AccountService
+            svc = AccountService(self.session)
+            await svc.record_audit(
+                row.account_id,
+                "AUTO_RECHARGE_TRIGGERED",
+                metadata={"balance": str(new_balance), "threshold": str(row.auto_recharge_threshold)}
+            )
+
+        # Update Redis cache with Circuit Breaker
+        if self._is_redis_open():
+            try:
+                await self._cache_balance(telegram_id, new_balance)
+                self._redis_success()
+            except Exception as e:
+                self._redis_failure(e)
+
+        return new_balance
+
     def _is_redis_open(self) -> bool:
         """Check if Circuit Breaker allows Redis calls."""
-        if _redis_cb_state["status"] == "OPEN":
-            if (datetime.utcnow().timestamp() - _redis_cb_state["last_failure"]) > REDIS_CB_RECOVERY_TIME:
-                _redis_cb_state["status"] = "HALF_OPEN"
-                return True
-            return False
-        return True
+        return _redis_breaker.allow()
 
     def _redis_failure(self, e):
         """Record Redis failure and potentially trip the breaker."""
-        _redis_cb_state["failure_count"] += 1
-        _redis_cb_state["last_failure"] = datetime.utcnow().timestamp()
-        if _redis_cb_state["failure_count"] >= REDIS_CB_THRESHOLD:
-            _redis_cb_state["status"] = "OPEN"
-            print(f"CRITICAL: Redis Circuit Breaker TRIP! Status: OPEN. Error: {e}")
+        _redis_breaker.record_failure(e)
 
     def _redis_success(self):
         """Record Redis success and reset breaker."""
-        _redis_cb_state["failure_count"] = 0
-        _redis_cb_state["status"] = "CLOSED"
+        _redis_breaker.record_success()
 
-    def _cache_balance(self, telegram_id: int, balance: Decimal):
-        """Update the high-speed Redis cache for real-time checks."""
+    async def _cache_balance(self, telegram_id: int, balance: Decimal):
+        """Update the high-speed Redis cache for real-time checks (stored as int 1e-8 USD)."""
         try:
-            redis_client.set(f"balance:{telegram_id}", str(balance), ex=3600)
+            await redis_client.set(f"balance_sat:{telegram_id}", to_satoshi(balance), ex=BALANCE_CACHE_TTL)
         except Exception as e:
             self._redis_failure(e)
 
@@ -205,10 +369,11 @@ class LedgerBalanceService:
         """Get balance from Redis with fallback to Postgres (Degraded Mode)."""
         if self._is_redis_open():
             try:
-                val = redis_client.get(f"balance:{telegram_id}")
+                # GETEX keeps hot balances resident: read + TTL refresh in one round trip
+                val = await redis_client.getex(f"balance_sat:{telegram_id}", ex=BALANCE_CACHE_TTL)
                 if val is not None:
                     self._redis_success()
-                    return Decimal(val.decode() if isinstance(val, bytes) else val)
+                    return from_satoshi(int(val))
             except Exception as e:
                 self._redis_failure(e)
             
@@ -216,6 +381,6 @@ class LedgerBalanceService:
         account = await self.get_account_by_tg_id(telegram_id)
         if account:
             if self._is_redis_open():
-                self._cache_balance(telegram_id, account.balance_usd)
+                await self._cache_balance(telegram_id, account.balance_usd)
             return account.balance_usd
         return Decimal("0.00000000")
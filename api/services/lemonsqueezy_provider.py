@@ -5,7 +5,6 @@ Implements PaymentProvider interface for Lemon Squeezy integration.
 Handles checkout creation, webhook verification, and order processing.
 """
 
-import hashlib
 import hmac
 import logging
 import secrets
@@ -26,12 +25,13 @@ from api.services.payment_engine import (
     WebhookEvent,
     InvalidSignatureError,
     ProviderError,
+    hmac_sha256_template,
 )
 from config.settings import (
     LEMONSQUEEZY_API_KEY,
     LEMONSQUEEZY_STORE_ID,
     LEMONSQUEEZY_WEBHOOK_SECRET,
-    CREDITS_PER_USD,
+    USD_TO_CREDITS,
 )
 
 logger = logging.getLogger(__name__)
@@ -66,6 +66,7 @@ class LemonSqueezyProvider(PaymentProvider):
         self._api_key = api_key or LEMONSQUEEZY_API_KEY
         self._store_id = store_id or LEMONSQUEEZY_STORE_ID
         self._webhook_secret = webhook_secret or LEMONSQUEEZY_WEBHOOK_SECRET
+        self._hmac_template = hmac_sha256_template(self._webhook_secret) if self._webhook_secret else None
         self._balance_service = balance_service
         
         if not self._api_key:
@@ -95,7 +96,7 @@ class LemonSqueezyProvider(PaymentProvider):
             )
         
         # Calculate credits from USD amount
-        credits_amount = int(request.amount_usd * CREDITS_PER_USD)
+        credits_amount = int(request.amount_usd * USD_TO_CREDITS)
         
         # Build checkout data
         # We use a dynamic checkout with custom price
@@ -203,11 +204,9 @@ class LemonSqueezyProvider(PaymentProvider):
             return False
         
         try:
-            expected_signature = hmac.new(
-                self._webhook_secret.encode("utf-8"),
-                event.raw_body,
-                hashlib.sha256
-            ).hexdigest()
+            mac = self._hmac_template.copy()
+            mac.update(event.raw_body)
+            expected_signature = mac.hexdigest()
             
             # Signature is in format: sha256=<hex>
             provided = event.signature
@@ -257,7 +256,7 @@ class LemonSqueezyProvider(PaymentProvider):
             return None
         
         # Get payment amount
-        total_usd = Decimal(str(order_data.get("total", 0))) / 100
+        total_usd = Decimal(int(order_data.get("total", 0))).scaleb(-2)  # Cents to USD
         
         logger.info(
             f"LemonSqueezy order completed: order={order_id}, "
@@ -6,22 +6,43 @@ unified interface, transaction management, and error handling.
 """
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from datetime import datetime
-from decimal import Decimal
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
 from enum import Enum
 import asyncio
+import email.utils
+import functools
 import hashlib
-import json
+import hmac
 import logging
+import os
+import random
+import re
 import secrets
 import time
-from typing import Optional, Any, List, Dict, Union
+import types
+from typing import Optional, Any, Awaitable, Callable, List, Dict, Union
 
 import httpx
+import orjson
+
+from api.services.metrics import (
+    PaymentTimer,
+    WebhookTimer,
+    api_request_duration,
+    track_payment_error,
+    track_payment_request,
+    track_webhook_event,
+)
 
 logger = logging.getLogger(__name__)
 
+# Decimal constants reused on the webhook paths instead of re-parsing per call
+_ZERO = Decimal("0")
+_CENT = Decimal("0.01")
+_AMOUNT_TOLERANCE = Decimal("0.10")  # Allowed drift between Paddle total and requested amount
+
 
 # ============================================================================
 # Enums
@@ -54,7 +75,7 @@ class TransactionType(str, Enum):
 # Data Models
 # ============================================================================
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PaymentRequest:
     """Request to create a payment."""
     user_id: int
@@ -62,13 +83,20 @@ class PaymentRequest:
     method: PaymentMethod
     idempotency_key: str = field(default_factory=lambda: secrets.token_hex(16))
     metadata: dict = field(default_factory=dict)
+    amount_cents: int = field(init=False, repr=False)  # Converted once for providers
     
     def __post_init__(self):
         if self.amount_usd <= 0:
             raise ValueError("Amount must be positive")
+        # Truncate like int(amount_usd) did, so sub-cent amounts never round up a price tier
+        object.__setattr__(
+            self,
+            "amount_cents",
+            int(self.amount_usd.scaleb(2).to_integral_value(rounding=ROUND_DOWN)),
+        )
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PaymentResult:
     """Result of payment creation."""
     payment_id: str
@@ -84,7 +112,7 @@ class PaymentResult:
         return self.status != PaymentStatus.FAILED
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Transaction:
     """Record of a financial transaction."""
     id: str
@@ -113,7 +141,7 @@ class Transaction:
         }
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class WebhookEvent:
     """Incoming webhook event from payment provider."""
     provider: PaymentMethod
@@ -123,6 +151,21 @@ class WebhookEvent:
     raw_body: bytes
     signature: str
     timestamp: datetime = field(default_factory=datetime.utcnow)
+    
+    @property
+    def dedup_key(self) -> str:
+        """
+        Idempotency key for this delivery.
+        Uses the provider's event id, or a BLAKE2b digest of provider and
+        raw body when the provider retries without one.
+        """
+        if self.event_id:
+            return self.event_id
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.provider.value.encode())
+        digest.update(b"|")
+        digest.update(self.raw_body)
+        return digest.hexdigest()
 
 
 # ============================================================================
@@ -166,6 +209,24 @@ class ProviderError(PaymentError):
 # Abstract Interfaces
 # ============================================================================
 
+# hashlib.sha256 is the OpenSSL constructor on standard CPython builds; hmac
+# then runs the whole MAC inside OpenSSL, which uses SHA-NI/ARMv8 SHA
+# instructions where the CPU has them. A build without OpenSSL falls back to
+# the much slower pure-C implementation.
+HMAC_SHA256_OPENSSL = hashlib.sha256.__name__ == "openssl_sha256"
+if not HMAC_SHA256_OPENSSL:
+    logger.warning("hashlib is not OpenSSL-backed; webhook HMAC verification will be slow")
+
+
+def hmac_sha256_template(secret: str) -> hmac.HMAC:
+    """
+    Keyed HMAC-SHA256 state for webhook verification.
+    Providers build it once and .copy() it per webhook, so the key schedule
+    is not redone for every event.
+    """
+    return hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+
 class PaymentProvider(ABC):
     """Abstract interface for payment providers."""
     
@@ -187,7 +248,11 @@ class PaymentProvider(ABC):
     
     @abstractmethod
     async def verify_webhook(self, event: WebhookEvent) -> bool:
-        """Verify webhook signature."""
+        """
+        Verify webhook signature.
+        HMAC-based providers should copy a hmac_sha256_template() built in
+        __init__ rather than keying a new HMAC per event.
+        """
         pass
     
     @abstractmethod
@@ -205,6 +270,13 @@ class PaymentProvider(ABC):
         raise NotImplementedError(f"{self.name} does not support refunds")
 
 
+# How long completed idempotency records are kept (seconds)
+IDEMPOTENCY_TTL = 86400
+# How long an in-flight "processing" claim blocks redeliveries; roughly the
+# webhook timeout, so a worker that dies mid-webhook doesn't block retries
+IDEMPOTENCY_PROCESSING_TTL = 120
+
+
 class BalanceManager(ABC):
     """Abstract interface for balance operations."""
     
@@ -227,10 +299,126 @@ class BalanceManager(ABC):
         """
         pass
     
+    async def update_balance_batch(
+        self,
+        items: List[tuple[int, Decimal, Transaction, str]],
+    ) -> List[Union[Decimal, Exception]]:
+        """
+        Apply several (user_id, amount, transaction, idempotency_key) updates.
+        Returns the new balance or the raised error per item, in order.
+        Override to share one database transaction across the batch.
+        """
+        results: List[Union[Decimal, Exception]] = []
+        for user_id, amount, transaction, idempotency_key in items:
+            try:
+                results.append(await self.update_balance(user_id, amount, transaction, idempotency_key))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    async def debit_atomic(
+        self,
+        user_id: int,
+        amount: Decimal,
+        transaction: Transaction,
+        idempotency_key: str,
+    ) -> Optional[tuple[Decimal, Decimal]]:
+        """
+        Debit amount only if the balance covers it.
+        Returns (balance_before, balance_after), or None if the balance is
+        insufficient. Backends should override this with a single
+        conditional update; the default checks then updates and is racy.
+        """
+        current = await self.get_balance(user_id)
+        if current < amount:
+            return None
+        new_balance = await self.update_balance(user_id, -amount, transaction, idempotency_key)
+        return current, new_balance
+    
     @abstractmethod
     async def check_idempotency(self, key: str) -> Optional[dict]:
         """Check if operation was already performed."""
         pass
+    
+    async def check_idempotency_many(self, keys: List[str]) -> Dict[str, dict]:
+        """
+        Check several idempotency keys at once.
+        Returns records for the keys that were already performed.
+        Override with a single-query lookup where the backend supports it.
+        """
+        results = {}
+        for key in keys:
+            record = await self.check_idempotency(key)
+            if record:
+                results[key] = record
+        return results
+    
+    async def try_claim_idempotency(
+        self,
+        key: str,
+        payload: Optional[dict] = None,
+        ttl: int = IDEMPOTENCY_PROCESSING_TTL,
+    ) -> Optional[dict]:
+        """
+        Claim an idempotency key before performing the operation.
+        Returns None if the claim succeeded, or the existing record if the
+        key was already claimed or performed. Backends with an atomic
+        set-if-absent should override this; the default only checks.
+        """
+        return await self.check_idempotency(key)
+    
+    async def complete_idempotency(self, key: str, record: dict, ttl: int = IDEMPOTENCY_TTL) -> None:
+        """Replace a claim with the final record of the operation."""
+        pass
+    
+    async def release_idempotency(self, key: str) -> None:
+        """Drop a claim so the operation can be retried."""
+        pass
+
+
+class BatchedIdempotencyCache:
+    """
+    Coalesces concurrent idempotency checks into one backend lookup.
+    
+    The first check starts a short timer; every check arriving before it
+    fires joins the same batch, which is resolved with a single
+    check_idempotency_many() call.
+    """
+    
+    def __init__(self, balance_manager: BalanceManager, window: float = 0.002):
+        self._balance_manager = balance_manager
+        self._window = window
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+    
+    async def check(self, key: str) -> Optional[dict]:
+        """Check a single key, sharing the round trip with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._start_flush)
+        return await future
+    
+    def _start_flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        asyncio.ensure_future(self._flush(pending))
+    
+    async def _flush(self, pending: Dict[str, List[asyncio.Future]]):
+        try:
+            found = await self._balance_manager.check_idempotency_many(list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        
+        for key, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(found.get(key))
 
 
 class NotificationService(ABC):
@@ -262,6 +450,132 @@ class NotificationService(ABC):
         pass
 
 
+class WebhookCreditBatcher:
+    """
+    Groups balance updates from concurrent webhook deliveries per provider.
+    
+    Updates queue for up to `window` seconds or `max_batch` items, then are
+    applied with one update_balance_batch() call. Batches for the same
+    provider are applied one at a time, in arrival order.
+    """
+    
+    def __init__(self, balance_manager: BalanceManager, window: float = 0.01, max_batch: int = 100):
+        self._balance_manager = balance_manager
+        self._window = window
+        self._max_batch = max_batch
+        self._queues: Dict[str, list] = {}
+        self._handles: Dict[str, asyncio.TimerHandle] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+    
+    async def submit(
+        self,
+        provider: str,
+        user_id: int,
+        amount: Decimal,
+        transaction: Transaction,
+        idempotency_key: str,
+    ) -> Decimal:
+        """Queue a balance update and wait for its batch; returns the new balance."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.setdefault(provider, [])
+        queue.append((user_id, amount, transaction, idempotency_key, future))
+        if len(queue) >= self._max_batch:
+            self._start_flush(provider)
+        elif provider not in self._handles:
+            self._handles[provider] = loop.call_later(self._window, self._start_flush, provider)
+        return await future
+    
+    def _start_flush(self, provider: str):
+        handle = self._handles.pop(provider, None)
+        if handle:
+            handle.cancel()
+        batch = self._queues.pop(provider, None)
+        if batch:
+            asyncio.ensure_future(self._flush(provider, batch))
+    
+    async def _flush(self, provider: str, batch: list):
+        try:
+            lock = self._locks.setdefault(provider, asyncio.Lock())
+            async with lock:
+                results = await self._balance_manager.update_balance_batch(
+                    [item[:4] for item in batch]
+                )
+            if len(results) != len(batch):
+                raise PaymentError(
+                    f"update_balance_batch returned {len(results)} results for {len(batch)} updates"
+                )
+            for item, result in zip(batch, results):
+                future = item[4]
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Webhook credit batch for {provider} failed: {e}")
+            for item in batch:
+                if not item[4].done():
+                    item[4].set_exception(e)
+        finally:
+            # Never leave a webhook waiting on a batch that is gone
+            for item in batch:
+                if not item[4].done():
+                    item[4].set_exception(PaymentError("Webhook credit batch was cancelled"))
+
+
+class NotificationDispatcher:
+    """
+    Sends user notifications off the webhook response path.
+    
+    Notifications go into a bounded queue drained by `workers` background
+    tasks, started on first use. When the queue is full the notification
+    is logged and dropped so a slow notification backend never blocks a
+    webhook acknowledgement.
+    """
+    
+    def __init__(self, notifications: NotificationService, workers: int = 8, maxsize: int = 10_000):
+        self._notifications = notifications
+        self._worker_count = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._workers: List[asyncio.Task] = []
+    
+    def submit(self, method: str, **kwargs) -> None:
+        """Queue notifications.<method>(**kwargs) without waiting for it."""
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(self._worker_count)
+            ]
+        try:
+            self._queue.put_nowait((method, kwargs))
+        except asyncio.QueueFull:
+            logger.warning(f"Notification queue full, dropping {method} for user {kwargs.get('user_id')}")
+    
+    async def _worker(self):
+        while True:
+            method, kwargs = await self._queue.get()
+            try:
+                await getattr(self._notifications, method)(**kwargs)
+            except Exception as e:
+                logger.error(f"Notification {method} failed: {e}")
+            finally:
+                self._queue.task_done()
+    
+    async def close(self, timeout: float = 5.0):
+        """Give queued notifications up to `timeout` seconds to send, then stop the workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._queue.qsize()} unsent notifications on shutdown")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
 # ============================================================================
 # Payment Engine
 # ============================================================================
@@ -283,16 +597,29 @@ class PaymentEngine:
         self.notifications = notification_service
         self.low_balance_threshold = low_balance_threshold
         self._providers: dict[PaymentMethod, PaymentProvider] = {}
+        self._webhook_handlers: dict[PaymentMethod, Callable[[WebhookEvent], Awaitable]] = {}
+        self._idempotency = BatchedIdempotencyCache(balance_manager)
+        self._credits = WebhookCreditBatcher(balance_manager)
+        self._notify = NotificationDispatcher(notification_service)
+    
+    async def close(self):
+        """Flush pending notifications; call once on shutdown."""
+        await self._notify.close()
     
     def register_provider(self, method: PaymentMethod, provider: PaymentProvider):
         """Register a payment provider."""
         self._providers[method] = provider
+        # Bind the provider once so webhooks skip the registry lookup
+        self._webhook_handlers[method] = functools.partial(
+            self._handle_webhook, provider, method.value
+        )
     
     def get_provider(self, method: PaymentMethod) -> PaymentProvider:
         """Get provider by payment method."""
-        if method not in self._providers:
+        provider = self._providers.get(method)
+        if provider is None:
             raise PaymentError(f"Provider not registered: {method}")
-        return self._providers[method]
+        return provider
     
     async def create_payment(
         self,
@@ -309,7 +636,7 @@ class PaymentEngine:
         4. Return result
         """
         # Check idempotency
-        existing = await self.balance_manager.check_idempotency(request.idempotency_key)
+        existing = await self._idempotency.check(request.idempotency_key)
         if existing:
             return PaymentResult(
                 payment_id=existing.get("payment_id", ""),
@@ -327,49 +654,81 @@ class PaymentEngine:
         Process incoming webhook.
         
         1. Verify signature
-        2. Check idempotency
+        2. Claim idempotency key
         3. Process payment
         4. Update balance
         5. Send notification
         """
-        provider = self.get_provider(event.provider)
-        
+        handler = self._webhook_handlers.get(event.provider)
+        if handler is None:
+            raise PaymentError(f"Provider not registered: {event.provider}")
+        return await handler(event)
+    
+    async def _handle_webhook(
+        self,
+        provider: PaymentProvider,
+        provider_key: str,
+        event: WebhookEvent,
+    ) -> Optional[Transaction]:
+        """process_webhook() for one provider; bound per provider at registration."""
         # Verify signature
         if not await provider.verify_webhook(event):
             raise InvalidSignatureError(f"Invalid signature from {event.provider}")
         
-        # Check idempotency
-        existing = await self.balance_manager.check_idempotency(event.event_id)
+        dedup_key = event.dedup_key
+        
+        # Claim the event atomically so concurrent deliveries can't both credit
+        existing = await self.balance_manager.try_claim_idempotency(
+            dedup_key, {"status": "processing"}
+        )
         if existing:
-            return None  # Already processed
+            return None  # Already processed or in progress
         
-        # Process through provider
-        transaction = await provider.process_webhook(event)
-        if not transaction:
+        try:
+            # Process through provider
+            transaction = await provider.process_webhook(event)
+            if not transaction:
+                await self.balance_manager.release_idempotency(dedup_key)
+                return None
+            
+            # Update balance (batched with concurrent deliveries from this provider)
+            new_balance = await self._credits.submit(
+                provider_key,
+                user_id=transaction.user_id,
+                amount=transaction.amount_usd,
+                transaction=transaction,
+                idempotency_key=dedup_key,
+            )
+        except DuplicatePaymentError:
+            # Already in the ledger (e.g. redelivered after the Redis record expired)
+            await self.balance_manager.complete_idempotency(dedup_key, {"status": "completed"})
             return None
+        except Exception:
+            await self.balance_manager.release_idempotency(dedup_key)
+            raise
         
-        # Update balance
-        new_balance = await self.balance_manager.update_balance(
-            user_id=transaction.user_id,
-            amount=transaction.amount_usd,
-            transaction=transaction,
-            idempotency_key=event.event_id,
+        await self.balance_manager.complete_idempotency(
+            dedup_key,
+            {"status": "completed", "transaction": transaction.to_dict()},
         )
         
-        # Send notification
-        if transaction.type == TransactionType.TOPUP:
-            await self.notifications.notify_payment_success(
+        # Send notifications in the background so the webhook is acknowledged
+        # as soon as the balance update is committed
+        if transaction.type is TransactionType.TOPUP:
+            self._notify.submit(
+                "notify_payment_success",
                 user_id=transaction.user_id,
                 amount=transaction.amount_usd,
                 new_balance=new_balance,
             )
-        elif transaction.type == TransactionType.REFUND:
+        elif transaction.type is TransactionType.REFUND:
             # Notify and check for negative balance
             pass
         
         # Check low balance
         if new_balance < self.low_balance_threshold:
-            await self.notifications.notify_low_balance(
+            self._notify.submit(
+                "notify_low_balance",
                 user_id=transaction.user_id,
                 current_balance=new_balance,
             )
@@ -388,38 +747,115 @@ class PaymentEngine:
         
         Raises InsufficientBalanceError if balance too low.
         """
-        current_balance = await self.balance_manager.get_balance(user_id)
-        
-        if current_balance < amount:
-            raise InsufficientBalanceError(current_balance, amount)
-        
         transaction = Transaction(
-            id=f"txn_usage_{secrets.token_hex(8)}",
+            id="txn_usage_" + os.urandom(8).hex(),
             user_id=user_id,
             type=TransactionType.USAGE,
             amount_usd=-amount,  # Negative for charges
-            balance_before=current_balance,
-            balance_after=current_balance - amount,
+            balance_before=_ZERO,  # Replaced from the debit result
+            balance_after=_ZERO,
             source=product_id,
             metadata=details,
         )
         
         idempotency_key = f"usage:{user_id}:{transaction.id}"
         
-        await self.balance_manager.update_balance(
+        # Check and debit in one conditional update
+        balances = await self.balance_manager.debit_atomic(
             user_id=user_id,
-            amount=-amount,
+            amount=amount,
             transaction=transaction,
             idempotency_key=idempotency_key,
         )
+        if balances is None:
+            # Only the failure path pays for a separate balance read
+            current_balance = await self.balance_manager.get_balance(user_id)
+            raise InsufficientBalanceError(current_balance, amount)
         
-        return transaction
+        balance_before, balance_after = balances
+        return replace(transaction, balance_before=balance_before, balance_after=balance_after)
 
 
 # ============================================================================
 # Provider Implementations (stubs - to be implemented)
 # ============================================================================
 
+# Paddle-Signature header: "ts=<unix seconds>;h1=<hex HMAC-SHA256>"
+_PADDLE_SIGNATURE_RE = re.compile(r"ts=(\d+);h1=([0-9a-f]{64})")
+
+# Paddle API clients shared process-wide, keyed by (base_url, API key digest),
+# so providers built per request still reuse pooled TCP/TLS connections
+_PADDLE_CLIENTS: Dict[tuple, httpx.AsyncClient] = {}
+
+
+async def close_paddle_clients() -> None:
+    """Close the shared Paddle API clients; call once on shutdown."""
+    clients = list(_PADDLE_CLIENTS.values())
+    _PADDLE_CLIENTS.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header, in either the delta-seconds
+    or the HTTP-date form (RFC 7231). Returns None when absent or unparseable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class _TokenBucket:
+    """
+    Client-side request limiter: at most `rate` requests per second with
+    bursts up to `rate`. throttle() halves the rate after a 429 and the full
+    rate returns once `cooldown` seconds pass without another one.
+    """
+    
+    def __init__(self, rate: float, cooldown: float = 60.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.cooldown = cooldown
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._throttled_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self, now: float) -> None:
+        if self.rate < self.max_rate and now >= self._throttled_until:
+            self.rate = self.max_rate
+        self._tokens = min(self.max_rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self) -> None:
+        """Wait for a token; waiters are served in arrival order."""
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+    
+    def throttle(self) -> None:
+        """Halve the rate (to at least 1/s) for the next cooldown seconds."""
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(1.0, self.rate / 2)
+        self._throttled_until = now + self.cooldown
+
+
 class PaddleProvider(PaymentProvider):
     """Paddle payment provider implementation."""
     
@@ -427,13 +863,34 @@ class PaddleProvider(PaymentProvider):
     PRODUCT_ID = "pro_01kbtwsmrfcxsv5fpcyb83v7mn"
     
     # Price IDs from Paddle Dashboard
-    PRICE_TIERS = {
+    PRICE_TIERS = types.MappingProxyType({
         5: "pri_01kbtwwg8hdst8kttvpq4dm2b5",    # $5
         10: "pri_01kbtwwv5tfbq5jb5j24wj5c8h",   # $10
         25: "pri_01kbtwx65x07dxsp5nps3j17r7",   # $25
         50: "pri_01kbtwxf1hmdez5sptk0j4qbjr",   # $50
         100: "pri_01kbtwxq1zjctb4dkg62cpv6ca",   # $100
-    }
+    })
+    SUPPORTED_AMOUNTS = frozenset(PRICE_TIERS)
+    
+    # Paddle transaction statuses mapped to our enum
+    _STATUS_MAP = types.MappingProxyType({
+        "draft": PaymentStatus.PENDING,
+        "ready": PaymentStatus.PENDING,
+        "billed": PaymentStatus.PROCESSING,
+        "completed": PaymentStatus.COMPLETED,
+        "canceled": PaymentStatus.CANCELLED,
+        "past_due": PaymentStatus.FAILED,
+    })
+    
+    # Retry backoff: BASE_DELAY * 2**attempt, stretched by up to JITTER so
+    # concurrent failures don't retry in lockstep, capped at MAX_DELAY seconds
+    BASE_DELAY = 1.0
+    MAX_DELAY = 30.0
+    JITTER = 0.5
+    
+    # Client-side ceiling on Paddle API requests per second, halved for
+    # a minute after each 429 so we back off instead of feeding a 429 storm
+    RATE_LIMIT = 20.0
     
     def __init__(
         self,
@@ -444,6 +901,7 @@ class PaddleProvider(PaymentProvider):
     ):
         self.api_key = api_key
         self.webhook_secret = webhook_secret
+        self._hmac_template = hmac_sha256_template(webhook_secret)
         self.sandbox = sandbox
         self.max_retries = max_retries
         self.base_url = (
@@ -451,24 +909,38 @@ class PaddleProvider(PaymentProvider):
             else "https://api.paddle.com"
         )
         self._client: Optional[Any] = None
+        self._limiter = _TokenBucket(self.RATE_LIMIT)
     
     @property
     def name(self) -> str:
         return "paddle"
     
     async def _get_client(self):
-        """Get or create httpx client."""
+        """Get the shared httpx client for this base URL and API key."""
         if self._client is None:
-            self._client = httpx.AsyncClient(
-                base_url=self.base_url,
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                timeout=30.0,
+            key = (
+                self.base_url,
+                hashlib.blake2b(self.api_key.encode(), digest_size=8).hexdigest(),
             )
+            client = _PADDLE_CLIENTS.get(key)
+            if client is None or client.is_closed:
+                client = _PADDLE_CLIENTS[key] = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers={
+                        "Authorization": f"Bearer {self.api_key}",
+                        "Content-Type": "application/json",
+                    },
+                    timeout=30.0,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                )
+            self._client = client
         return self._client
     
+    def _backoff_delay(self, attempt: int) -> float:
+        """Jittered exponential backoff before retry number attempt + 1."""
+        delay = self.BASE_DELAY * (2 ** attempt) * (1 + random.random() * self.JITTER)
+        return min(self.MAX_DELAY, delay)
+    
     async def _request_with_retry(
         self,
         method: str,
@@ -479,12 +951,11 @@ class PaddleProvider(PaymentProvider):
         
         client = await self._get_client()
         
-        from api.services.metrics import api_request_duration, track_api_request
-        
         last_error: Optional[Exception] = None
         
         for attempt in range(self.max_retries):
             try:
+                await self._limiter.acquire()
                 start_time = time.time()
                 response = await client.request(method, path, **kwargs)
                 duration = time.time() - start_time
@@ -499,10 +970,15 @@ class PaddleProvider(PaymentProvider):
                 logger.debug(f"Paddle API {method} {path}: {response.status_code}")
                 
                 if response.status_code == 429:
-                    # Rate limited - wait and retry
+                    # Rate limited - slow every caller down, then wait and retry
+                    self._limiter.throttle()
                     if attempt < self.max_retries - 1:
-                        retry_after = int(response.headers.get("Retry-After", 5))
-                        await asyncio.sleep(retry_after)
+                        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                        if retry_after is not None:
+                            # Don't let a long Retry-After park the request
+                            await asyncio.sleep(min(retry_after, self.MAX_DELAY))
+                        else:
+                            await asyncio.sleep(self._backoff_delay(attempt))
                         continue
                     else:
                         break
@@ -510,13 +986,13 @@ class PaddleProvider(PaymentProvider):
                 if response.status_code >= 500:
                     # Server error - retry with backoff
                     if attempt < self.max_retries - 1:
-                        await asyncio.sleep(2 ** attempt)
+                        await asyncio.sleep(self._backoff_delay(attempt))
                         continue
                     else:
                         break
                 
                 # Parse response
-                data = response.json()
+                data = orjson.loads(response.content)
                 
                 if response.status_code >= 400:
                     # Client error - don't retry
@@ -533,7 +1009,7 @@ class PaddleProvider(PaymentProvider):
                 # Network errors - retry with backoff
                 if attempt < self.max_retries - 1:
                     last_error = ProviderError("paddle", "network", str(e))
-                    await asyncio.sleep(2 ** attempt)
+                    await asyncio.sleep(self._backoff_delay(attempt))
                 else:
                     last_error = ProviderError("paddle", "network", str(e))
                     break
@@ -554,24 +1030,20 @@ class PaddleProvider(PaymentProvider):
         cancel_url: str,
     ) -> PaymentResult:
         """Create Paddle checkout session."""
-        from api.services.metrics import PaymentTimer, track_payment_request, track_payment_error
+        # Reject amounts without a price tier (including any with cents)
+        # before starting the timer
+        amount_int, cents = divmod(request.amount_cents, 100)
+        if cents or amount_int not in self.SUPPORTED_AMOUNTS:
+            logger.error(f"No price_id found for amount ${request.amount_usd}")
+            return PaymentResult(
+                payment_id="",
+                status=PaymentStatus.FAILED,
+                error=f"Amount ${request.amount_usd} not supported. Available: {sorted(self.SUPPORTED_AMOUNTS)}",
+            )
+        price_id = self.PRICE_TIERS[amount_int]
         
         try:
             with PaymentTimer("paddle"):
-                # Determine amount and price
-                amount_int = int(request.amount_usd)
-                
-                # Get price_id from PRICE_TIERS
-                price_id = self.PRICE_TIERS.get(amount_int)
-                
-                if not price_id:
-                    logger.error(f"No price_id found for amount ${amount_int}")
-                    return PaymentResult(
-                        payment_id="",
-                        status=PaymentStatus.FAILED,
-                        error=f"Amount ${amount_int} not supported. Available: {list(self.PRICE_TIERS.keys())}",
-                    )
-                
                 # Build request payload for Paddle API v2
                 # Using price_id from Paddle Dashboard
                 payload = {
@@ -581,18 +1053,18 @@ class PaddleProvider(PaymentProvider):
                             "quantity": 1,
                         }
                     ],
-                    "custom_data": json.dumps({
+                    "custom_data": {
                         "user_id": str(request.user_id),
                         "idempotency_key": request.idempotency_key,
                         "amount_usd": str(request.amount_usd),
-                    }),
+                    },
                     "checkout": {
                         "url": success_url,
                     },
                 }
                 
                 # Log payload for debugging
-                logger.debug(f"Paddle payload: {json.dumps(payload, indent=2)}")
+                logger.debug("Paddle payload: %s", payload)
                 
                 # Add cancel URL if different from success
                 if cancel_url and cancel_url != success_url:
@@ -603,10 +1075,12 @@ class PaddleProvider(PaymentProvider):
                 logger.info(f"Creating Paddle checkout for user {request.user_id}, ${request.amount_usd}")
                 
                 # Create transaction
+                # Serialize once with orjson; the client already sends
+                # Content-Type: application/json
                 response = await self._request_with_retry(
                     "POST",
                     "/transactions",
-                    json=payload,
+                    content=orjson.dumps(payload),
                 )
                 
                 data = response.get("data", {})
@@ -638,26 +1112,13 @@ class PaddleProvider(PaymentProvider):
     
     async def verify_webhook(self, event: WebhookEvent) -> bool:
         """Verify Paddle webhook signature (HMAC-SHA256)."""
-        import hmac
-        import time
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             # Parse signature: ts=xxx;h1=xxx
-            parts = {}
-            for item in event.signature.split(";"):
-                if "=" in item:
-                    k, v = item.split("=", 1)
-                    parts[k] = v
-            
-            timestamp = parts.get("ts")
-            received = parts.get("h1")
-            
-            if not timestamp or not received:
+            match = _PADDLE_SIGNATURE_RE.match(event.signature)
+            if match is None:
                 logger.warning("Missing timestamp or signature in Paddle webhook")
                 return False
+            timestamp, received = match.groups()
             
             # Check timestamp age (max 5 minutes)
             age = abs(int(timestamp) - int(time.time()))
@@ -665,15 +1126,14 @@ class PaddleProvider(PaymentProvider):
                 logger.warning(f"Paddle webhook too old: {age}s")
                 return False
             
-            # Compute expected signature
-            signed_payload = f"{timestamp}:{event.raw_body.decode()}"
-            expected = hmac.new(
-                self.webhook_secret.encode(),
-                signed_payload.encode(),
-                hashlib.sha256,
-            ).hexdigest()
+            # Compute expected signature over "<ts>:<body>"
+            mac = self._hmac_template.copy()
+            mac.update(timestamp.encode())
+            mac.update(b":")
+            mac.update(event.raw_body)
             
-            if not hmac.compare_digest(expected, received):
+            # h1 is 64 hex chars per the regex, so compare the raw 32-byte digests
+            if not hmac.compare_digest(mac.digest(), bytes.fromhex(received)):
                 logger.warning("Paddle webhook signature mismatch")
                 return False
             
@@ -685,15 +1145,12 @@ class PaddleProvider(PaymentProvider):
     
     async def process_webhook(self, event: WebhookEvent) -> Optional[Transaction]:
         """Process Paddle webhook event."""
-        from api.services.metrics import WebhookTimer, track_webhook_event
-        
         event_type = event.event_type
         data = event.data
         
-        with WebhookTimer("paddle"):
-            logger.info(f"Processing Paddle webhook: {event_type}")
-        
-        from api.services.metrics import track_webhook_event
+        # Latency is recorded by the route's WebhookTimer("paddle"), which
+        # spans verification, the idempotency claim, this dispatch and the credit
+        logger.info(f"Processing Paddle webhook: {event_type}")
         
         if event_type == "transaction.completed":
             result = await self._handle_transaction_completed(data)
@@ -715,27 +1172,24 @@ class PaddleProvider(PaymentProvider):
             track_webhook_event("paddle", event_type, "ignored")
             return None
     
+    @staticmethod
+    def _parse_custom_data(raw: Any) -> dict:
+        """Parse custom_data, which Paddle may send as an object or a JSON string."""
+        if isinstance(raw, dict):
+            return raw
+        if isinstance(raw, (str, bytes)):
+            try:
+                parsed = orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                return {}
+            return parsed if isinstance(parsed, dict) else {}
+        return {}
+    
     async def _handle_transaction_completed(self, data: dict) -> Optional[Transaction]:
         """Handle successful payment."""
-        import logging
-        import json
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             transaction_id = data.get("id")
-            custom_data_raw = data.get("custom_data", {})
-            
-            # Parse custom data - Paddle may send as object or JSON string
-            if isinstance(custom_data_raw, str):
-                try:
-                    custom_data = json.loads(custom_data_raw)
-                except json.JSONDecodeError:
-                    custom_data = {}
-            elif isinstance(custom_data_raw, dict):
-                custom_data = custom_data_raw
-            else:
-                custom_data = {}
+            custom_data = self._parse_custom_data(data.get("custom_data"))
             
             # Get user_id - frontend sends as "user_id" with telegram_id value
             user_id_str = custom_data.get("user_id", "0")
@@ -751,13 +1205,13 @@ class PaddleProvider(PaymentProvider):
             paddle_amount = totals.get("total", "0")
             
             # Convert from cents to dollars
-            amount_usd = Decimal(paddle_amount) / 100
+            amount_usd = Decimal(int(paddle_amount)).scaleb(-2)
             
             # Validate amount matches expected (if provided)
             expected_amount_str = custom_data.get("amount_usd", "")
             if expected_amount_str:
                 expected_amount = Decimal(expected_amount_str)
-                if abs(amount_usd - expected_amount) > Decimal("0.10"):
+                if abs(amount_usd - expected_amount) > _AMOUNT_TOLERANCE:
                     logger.warning(
                         f"Amount mismatch in Paddle transaction {transaction_id}: "
                         f"expected ${expected_amount}, got ${amount_usd}"
@@ -771,8 +1225,8 @@ class PaddleProvider(PaymentProvider):
                 user_id=user_id,
                 type=TransactionType.TOPUP,
                 amount_usd=amount_usd,
-                balance_before=Decimal("0"),  # Will be set by BalanceManager
-                balance_after=Decimal("0"),   # Will be set by BalanceManager
+                balance_before=_ZERO,  # Will be set by BalanceManager
+                balance_after=_ZERO,   # Will be set by BalanceManager
                 source="paddle",
                 external_id=transaction_id,
                 metadata={
@@ -787,20 +1241,9 @@ class PaddleProvider(PaymentProvider):
     
     async def _handle_payment_failed(self, data: dict):
         """Handle failed payment - log and notify."""
-        import logging
-        import json
-        
-        logger = logging.getLogger(__name__)
-        
         transaction_id = data.get("id")
         error_code = data.get("error", {}).get("code", "unknown")
-        
-        custom_data_str = data.get("custom_data", "{}")
-        try:
-            custom_data = json.loads(custom_data_str)
-        except json.JSONDecodeError:
-            custom_data = {}
-
+        custom_data = self._parse_custom_data(data.get("custom_data"))
         user_id = custom_data.get("user_id")
 
         logger.warning(
@@ -812,20 +1255,9 @@ class PaddleProvider(PaymentProvider):
     
     async def _handle_refund(self, data: dict) -> Optional[Transaction]:
         """Handle refund - deduct from balance."""
-        import logging
-        import json
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             transaction_id = data.get("id")
-            custom_data_str = data.get("custom_data", "{}")
-            
-            try:
-                custom_data = json.loads(custom_data_str)
-            except json.JSONDecodeError:
-                custom_data = {}
-
+            custom_data = self._parse_custom_data(data.get("custom_data"))
             user_id = int(custom_data.get("user_id", 0))
             
             if not user_id:
@@ -835,7 +1267,7 @@ class PaddleProvider(PaymentProvider):
             # Get refund amount
             details = data.get("details", {})
             totals = details.get("totals", {})
-            refund_amount = Decimal(totals.get("total", "0")) / 100
+            refund_amount = Decimal(int(totals.get("total", "0"))).scaleb(-2)
             
             logger.info(f"Paddle refund: user={user_id}, amount=${refund_amount}")
             
@@ -844,8 +1276,8 @@ class PaddleProvider(PaymentProvider):
                 user_id=user_id,
                 type=TransactionType.REFUND,
                 amount_usd=-refund_amount,  # Negative for refund
-                balance_before=Decimal("0"),
-                balance_after=Decimal("0"),
+                balance_before=_ZERO,
+                balance_after=_ZERO,
                 source="paddle",
                 external_id=transaction_id,
                 metadata={
@@ -860,10 +1292,6 @@ class PaddleProvider(PaymentProvider):
     
     async def get_payment_status(self, payment_id: str) -> PaymentStatus:
         """Get Paddle transaction status."""
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             response = await self._request_with_retry(
                 "GET",
@@ -873,17 +1301,7 @@ class PaddleProvider(PaymentProvider):
             data = response.get("data", {})
             status = data.get("status", "").lower()
             
-            # Map Paddle statuses to our enum
-            status_map = {
-                "draft": PaymentStatus.PENDING,
-                "ready": PaymentStatus.PENDING,
-                "billed": PaymentStatus.PROCESSING,
-                "completed": PaymentStatus.COMPLETED,
-                "canceled": PaymentStatus.CANCELLED,
-                "past_due": PaymentStatus.FAILED,
-            }
-            
-            return status_map.get(status, PaymentStatus.PENDING)
+            return self._STATUS_MAP.get(status, PaymentStatus.PENDING)
             
         except ProviderError as e:
             if "not_found" in str(e).lower():
@@ -896,10 +1314,6 @@ class PaddleProvider(PaymentProvider):
     
     async def refund(self, payment_id: str, amount: Optional[Decimal] = None) -> bool:
         """Refund a Paddle payment."""
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             payload = {
                 "transaction_id": payment_id,
@@ -907,12 +1321,13 @@ class PaddleProvider(PaymentProvider):
             }
             
             if amount:
-                # Partial refund
+                # Partial refund, rounded to the nearest cent rather than truncated
+                cents = int(amount.scaleb(2).to_integral_value(rounding=ROUND_HALF_UP))
                 payload["type"] = "partial"
                 payload["items"] = [
                     {
                         "type": "partial",
-                        "amount": str(int(amount * 100)),
+                        "amount": str(cents),
                     }
                 ]
             else:
@@ -953,13 +1368,14 @@ class TelegramStarsProvider(PaymentProvider):
         {"stars": 2500, "usd": Decimal("50.00"), "label": "2500 ⭐ (~$50)"},
         {"stars": 5000, "usd": Decimal("100.00"), "label": "5000 ⭐ (~$100)"},
     ]
+    _PACKAGE_BY_USD = types.MappingProxyType({pkg["usd"]: pkg for pkg in STARS_PACKAGES})
     
     # Conversion rate: 1 USD = X Stars
     USD_TO_STARS_RATE = 50
     
     def __init__(self, bot_token: str, redis_client=None):
         self.bot_token = bot_token
-        self._redis = redis_client
+        self._redis = redis_client  # redis.asyncio client
     
     @property
     def name(self) -> str:
@@ -977,11 +1393,8 @@ class TelegramStarsProvider(PaymentProvider):
     
     @classmethod
     def get_package_for_usd(cls, usd: Decimal) -> Optional[dict]:
-        """Get Stars package matching USD amount."""
-        for pkg in cls.STARS_PACKAGES:
-            if abs(pkg["usd"] - usd) < Decimal("0.01"):
-                return pkg
-        return None
+        """Get Stars package matching USD amount (to the cent)."""
+        return cls._PACKAGE_BY_USD.get(usd.quantize(_CENT))
     
     async def create_checkout(
         self,
@@ -995,17 +1408,11 @@ class TelegramStarsProvider(PaymentProvider):
         Note: Actual invoice must be created via aiogram in bot handler.
         This method returns the data needed to create the invoice.
         """
-        from api.services.metrics import PaymentTimer, track_payment_request, track_payment_error
-        
         try:
             with PaymentTimer("telegram_stars"):
-                # Calculate Stars amount
-                stars = self.usd_to_stars(request.amount_usd)
-                
                 # Find matching package or use custom amount
                 package = self.get_package_for_usd(request.amount_usd)
-                if package:
-                    stars = package["stars"]
+                stars = package["stars"] if package else self.usd_to_stars(request.amount_usd)
                 
                 # Generate unique payload
                 timestamp = int(time.time())
@@ -1014,14 +1421,14 @@ class TelegramStarsProvider(PaymentProvider):
                 # Store pending payment data in Redis (if available)
                 if self._redis:
                     pending_key = f"pending_stars:{payload}"
-                    pending_data = json.dumps({
+                    pending_data = orjson.dumps({
                         "user_id": request.user_id,
                         "stars": stars,
                         "usd": str(request.amount_usd),
                         "idempotency_key": request.idempotency_key,
                         "created_at": timestamp,
                     })
-                    self._redis.setex(pending_key, 3600, pending_data)  # 1 hour expiry
+                    await self._redis.setex(pending_key, 3600, pending_data)  # 1 hour expiry
                 
                 logger.info(f"Stars invoice prepared: user={request.user_id}, {stars} stars (${request.amount_usd})")
                 
@@ -1072,13 +1479,6 @@ class TelegramStarsProvider(PaymentProvider):
         - telegram_payment_charge_id: Telegram payment ID
         - total_amount: Stars amount
         """
-        import logging
-        import json
-        
-        logger = logging.getLogger(__name__)
-        
-        from api.services.metrics import WebhookTimer, track_webhook_event
-        
         try:
             with WebhookTimer("telegram_stars"):
                 data = event.data
@@ -1097,19 +1497,20 @@ class TelegramStarsProvider(PaymentProvider):
                 usd_amount = self.stars_to_usd(stars_amount)
                 
                 if self._redis:
+                    # Read and clear the pending record in one round trip
                     pending_key = f"pending_stars:{payload}"
-                    pending_data = self._redis.get(pending_key)
+                    async with self._redis.pipeline(transaction=False) as pipe:
+                        pipe.get(pending_key)
+                        pipe.delete(pending_key)
+                        pending_data, _ = await pipe.execute()
                     
                     if pending_data:
-                        pending = json.loads(pending_data)
+                        pending = orjson.loads(pending_data)
                         # Validate user matches
                         if int(pending.get("user_id")) != int(user_id):
                             logger.warning(f"User mismatch in Stars payment: {user_id} vs {pending.get('user_id')}")
                         # Use stored USD amount for consistency
                         usd_amount = Decimal(pending.get("usd", str(usd_amount)))
-                        
-                        # Clean up pending data
-                        self._redis.delete(pending_key)
                 
                 logger.info(f"Stars payment success: user={user_id}, {stars_amount} stars (${usd_amount})")
                 track_webhook_event("telegram_stars", "payment", "success")
@@ -1120,8 +1521,8 @@ class TelegramStarsProvider(PaymentProvider):
                     user_id=int(user_id),
                     type=TransactionType.TOPUP,
                     amount_usd=usd_amount,
-                    balance_before=Decimal("0"),  # Will be set by BalanceManager
-                    balance_after=Decimal("0"),   # Will be set by BalanceManager
+                    balance_before=_ZERO,  # Will be set by BalanceManager
+                    balance_after=_ZERO,   # Will be set by BalanceManager
                     source="telegram_stars",
                     external_id=charge_id,
                     metadata={
@@ -1142,20 +1543,17 @@ class TelegramStarsProvider(PaymentProvider):
         
         Stars payments are instant - check if processed in Redis.
         """
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        
         try:
             if self._redis:
-                # Check if pending
-                pending_key = f"pending_stars:{payment_id}"
-                if self._redis.exists(pending_key):
-                    return PaymentStatus.PENDING
+                # Check pending and processed markers in one round trip
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.exists(f"pending_stars:{payment_id}")
+                    pipe.exists(f"stars_processed:{payment_id}")
+                    pending, processed = await pipe.execute()
                 
-                # Check if processed
-                processed_key = f"stars_processed:{payment_id}"
-                if self._redis.exists(processed_key):
+                if pending:
+                    return PaymentStatus.PENDING
+                if processed:
                     return PaymentStatus.COMPLETED
             
             # Unknown - assume pending
@@ -1,11 +1,97 @@
+import asyncio
+import logging
 from decimal import Decimal, ROUND_HALF_EVEN
-from typing import Optional
+from typing import List, Optional, Union
+
+import orjson
+from cachetools import TTLCache
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from api.db.base import AsyncSessionLocal, Transaction as DBTransaction, Account as DBAccount
-from api.services.payment_engine import BalanceManager, Transaction, TransactionType
-from api.services.ledger_balance import LedgerBalanceService
+from api.services.payment_engine import (
+    BalanceManager,
+    DuplicatePaymentError,
+    Transaction,
+    TransactionType,
+    IDEMPOTENCY_TTL,
+    IDEMPOTENCY_PROCESSING_TTL,
+)
+from api.services.ledger_balance import LedgerBalanceService, USD_QUANTUM, redis_client, _redis_breaker
+
+logger = logging.getLogger(__name__)
+
+# Per-process balance cache in front of get_balance. Entries are evicted
+# on local updates and when another worker publishes the user id on
+# BALANCE_INVALIDATE_CHANNEL.
+BALANCE_CACHE_TTL_SECONDS = 0.25
+BALANCE_INVALIDATE_CHANNEL = "bal_invalidate"
+BALANCE_LISTENER_MAX_BACKOFF = 30  # Seconds between listener reconnect attempts, at most
+_balance_cache: TTLCache = TTLCache(maxsize=100_000, ttl=BALANCE_CACHE_TTL_SECONDS)
+_publish_tasks: set[asyncio.Task] = set()
+
+
+def _as_duplicate(error: ValueError, idempotency_key: str) -> Exception:
+    """Map the ledger's 'already processed' top-up error to DuplicatePaymentError."""
+    if "already processed" in str(error.args[0] if error.args else ""):
+        return DuplicatePaymentError(idempotency_key)
+    return error
+
+
+def _invalidate_balance(user_id: int) -> None:
+    """
+    Drop the local entry and tell other workers to drop theirs.
+    The publish runs in the background behind the ledger's Redis circuit
+    breaker, so balance updates never wait on it.
+    """
+    _balance_cache.pop(user_id, None)
+    if not _redis_breaker.allow():
+        return
+    task = asyncio.ensure_future(_publish_invalidation(user_id))
+    _publish_tasks.add(task)
+    task.add_done_callback(_publish_tasks.discard)
+
+
+async def _publish_invalidation(user_id: int) -> None:
+    try:
+        await redis_client.publish(BALANCE_INVALIDATE_CHANNEL, str(user_id))
+        _redis_breaker.record_success()
+    except Exception as e:
+        _redis_breaker.record_failure(e)
+        logger.warning(f"Failed to publish balance invalidation for {user_id}: {e}")
+
+
+async def listen_for_balance_invalidations() -> None:
+    """
+    Evict local balance entries published by other workers. Runs until cancelled,
+    reconnecting with exponential backoff when the subscription drops.
+    """
+    backoff = 1.0
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(BALANCE_INVALIDATE_CHANNEL)
+            # Messages may have been missed while disconnected
+            _balance_cache.clear()
+            backoff = 1.0
+            async for message in pubsub.listen():
+                try:
+                    _balance_cache.pop(int(message["data"]), None)
+                except (TypeError, ValueError):
+                    continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Entries still expire after BALANCE_CACHE_TTL_SECONDS meanwhile
+            logger.warning(f"Balance invalidation listener disconnected, retrying in {backoff:.0f}s: {e}")
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, BALANCE_LISTENER_MAX_BACKOFF)
+
 
 class PostgresBalanceManager(BalanceManager):
     """
@@ -20,15 +106,20 @@ class PostgresBalanceManager(BalanceManager):
 
     async def get_balance(self, user_id: int) -> Decimal:
         """Get account balance by Telegram ID."""
+        balance = _balance_cache.get(user_id)
+        if balance is not None:
+            return balance
+        
         if self._provided_session:
             ledger = await self._get_ledger(self._provided_session)
             account = await ledger.get_account_by_tg_id(user_id)
-            return account.balance_usd
+        else:
+            async with AsyncSessionLocal() as session:
+                ledger = await self._get_ledger(session)
+                account = await ledger.get_account_by_tg_id(user_id)
         
-        async with AsyncSessionLocal() as session:
-            ledger = await self._get_ledger(session)
-            account = await ledger.get_account_by_tg_id(user_id)
-            return account.balance_usd
+        _balance_cache[user_id] = account.balance_usd
+        return account.balance_usd
 
     async def update_balance(
         self,
@@ -37,19 +128,30 @@ class PostgresBalanceManager(BalanceManager):
         transaction: Transaction,
         idempotency_key: str,
     ) -> Decimal:
-        """Record a transaction in the PostgreSQL ledger."""
-        if self._provided_session:
-            return await self._do_update(self._provided_session, user_id, amount, transaction, idempotency_key)
-            
-        async with AsyncSessionLocal() as session:
-            return await self._do_update(session, user_id, amount, transaction, idempotency_key)
+        """
+        Record a transaction in the PostgreSQL ledger.
+        Raises DuplicatePaymentError if the idempotency key is already in the ledger.
+        """
+        try:
+            if self._provided_session:
+                return await self._do_update(self._provided_session, user_id, amount, transaction, idempotency_key)
+                
+            async with AsyncSessionLocal() as session:
+                return await self._do_update(session, user_id, amount, transaction, idempotency_key)
+        except ValueError as e:
+            duplicate = _as_duplicate(e, idempotency_key)
+            if duplicate is e:
+                raise
+            raise duplicate from e
+        finally:
+            _invalidate_balance(user_id)
 
     async def _do_update(self, session, user_id, amount, transaction, idempotency_key):
         ledger = await self._get_ledger(session)
-        # Enforce Decimal precision and Banker's Rounding
-        amount_dec = Decimal(str(amount)).quantize(Decimal("0.00000001"), rounding=ROUND_HALF_EVEN)
         
-        if amount_dec > 0:
+        if amount > 0:
+            # Enforce Decimal precision and Banker's Rounding
+            amount_dec = Decimal(str(amount)).quantize(USD_QUANTUM, rounding=ROUND_HALF_EVEN)
             return await ledger.add_funds(
                 telegram_id=user_id,
                 amount=amount_dec,
@@ -61,11 +163,76 @@ class PostgresBalanceManager(BalanceManager):
                 telegram_id=user_id,
                 product_id=transaction.source,
                 units=1,
-                cost=-amount_dec,
+                cost=-amount,  # record_usage applies the 8-place rounding
                 idempotency_key=idempotency_key,
                 metadata=transaction.metadata
             )
 
+    async def update_balance_batch(
+        self,
+        items: List[tuple[int, Decimal, Transaction, str]],
+    ) -> List[Union[Decimal, Exception]]:
+        """
+        Apply several balance updates. Top-ups share one session and a
+        single commit (one savepoint each); debits go through update_balance.
+        """
+        results: List[Union[Decimal, Exception]] = [None] * len(items)
+        credits = [index for index, item in enumerate(items) if item[1] > 0]
+        try:
+            if credits:
+                entries = []
+                for index in credits:
+                    user_id, amount, transaction, idempotency_key = items[index]
+                    entries.append((
+                        user_id,
+                        Decimal(str(amount)).quantize(USD_QUANTUM, rounding=ROUND_HALF_EVEN),
+                        idempotency_key,
+                        transaction.metadata.get("reason") or transaction.source,
+                    ))
+                if self._provided_session:
+                    # The caller owns this session's transaction
+                    ledger = await self._get_ledger(self._provided_session)
+                    balances = await ledger.add_funds_many(entries, commit=False)
+                else:
+                    async with AsyncSessionLocal() as session:
+                        ledger = await self._get_ledger(session)
+                        balances = await ledger.add_funds_many(entries)
+                for index, balance in zip(credits, balances):
+                    if isinstance(balance, ValueError):
+                        balance = _as_duplicate(balance, items[index][3])
+                    results[index] = balance
+            
+            for index, (user_id, amount, transaction, idempotency_key) in enumerate(items):
+                if amount > 0:
+                    continue
+                try:
+                    results[index] = await self.update_balance(user_id, amount, transaction, idempotency_key)
+                except Exception as e:
+                    results[index] = e
+        finally:
+            for user_id in {item[0] for item in items}:
+                _invalidate_balance(user_id)
+        return results
+
+    async def debit_atomic(
+        self,
+        user_id: int,
+        amount: Decimal,
+        transaction: Transaction,
+        idempotency_key: str,
+    ) -> Optional[tuple[Decimal, Decimal]]:
+        """
+        Debit via the ledger's single-statement usage CTE, which only
+        deducts when balance_usd >= cost. Returns None when it refuses.
+        """
+        try:
+            new_balance = await self.update_balance(user_id, -amount, transaction, idempotency_key)
+        except ValueError as e:
+            if "BALANCE_EXHAUSTED" in e.args:
+                return None
+            raise
+        return new_balance + amount, new_balance
+
     async def check_idempotency(self, key: str) -> Optional[dict]:
         """Check if idempotency key exists in transactions table."""
         if self._provided_session:
@@ -81,3 +248,57 @@ class PostgresBalanceManager(BalanceManager):
         if tx:
             return {"processed": True, "type": tx.type}
         return None
+
+    async def check_idempotency_many(self, keys: list[str]) -> dict[str, dict]:
+        """Check several idempotency keys with a single query."""
+        if self._provided_session:
+            return await self._do_check_idempotency_many(self._provided_session, keys)
+            
+        async with AsyncSessionLocal() as session:
+            return await self._do_check_idempotency_many(session, keys)
+
+    async def _do_check_idempotency_many(self, session, keys):
+        stmt = select(DBTransaction.idempotency_key, DBTransaction.type).where(
+            DBTransaction.idempotency_key.in_(keys)
+        )
+        result = await session.execute(stmt)
+        return {key: {"processed": True, "type": tx_type} for key, tx_type in result.all()}
+
+    async def try_claim_idempotency(
+        self,
+        key: str,
+        payload: Optional[dict] = None,
+        ttl: int = IDEMPOTENCY_PROCESSING_TTL,
+    ) -> Optional[dict]:
+        """
+        Claim a key with Redis SET NX EX in one round trip.
+        The claim and the read of any existing record go in one MULTI/EXEC,
+        so duplicates don't cost a second round trip.
+        Falls back to the transactions table when Redis is unavailable;
+        the ledger's unique idempotency_key still prevents double credits.
+        """
+        redis_key = f"idempotency:{key}"
+        try:
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.set(redis_key, orjson.dumps(payload or {"status": "processing"}, default=str), nx=True, ex=ttl)
+            pipe.get(redis_key)
+            claimed, existing = await pipe.execute()
+            if claimed:
+                return None
+            if existing:
+                return orjson.loads(existing)
+        except Exception as e:
+            logger.warning(f"Idempotency claim via Redis failed for {key}: {e}")
+        return await self.check_idempotency(key)
+
+    async def complete_idempotency(self, key: str, record: dict, ttl: int = IDEMPOTENCY_TTL) -> None:
+        try:
+            await redis_client.set(f"idempotency:{key}", orjson.dumps(record, default=str), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store idempotency record for {key}: {e}")
+
+    async def release_idempotency(self, key: str) -> None:
+        try:
+            await redis_client.delete(f"idempotency:{key}")
+        except Exception as e:
+            logger.warning(f"Failed to release idempotency claim for {key}: {e}")
@@ -50,7 +50,7 @@ class UsageTracker:
         
         # Buffer counters in Redis for fast analytics (optional/redundant but good for real-time)
         month = datetime.utcnow().strftime("%Y-%m")
-        redis_client.incrby(f"usage:{telegram_id}:{month}:{product_id}", units)
+        await redis_client.incrby(f"usage:{telegram_id}:{month}:{product_id}", units)
         
         return new_balance
 
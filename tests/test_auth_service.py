@@ -0,0 +1,91 @@
+"""Tests for AuthService account snapshot caching."""
+
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+
+from api.services import auth_service
+from api.services.auth_service import AccountSnapshot, AuthService
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+@pytest.fixture(autouse=True)
+def clear_account_cache():
+    auth_service._account_cache.clear()
+    yield
+    auth_service._account_cache.clear()
+
+
+@pytest.fixture
+def account():
+    return MagicMock(
+        id=uuid4(),
+        telegram_id=12345,
+        google_id=None,
+        email="user@example.com",
+        balance_usd=Decimal("5.00"),
+        email_verified=True,
+        created_at=datetime(2024, 1, 1),
+    )
+
+
+@pytest.fixture
+def db(account):
+    db = MagicMock()
+    db.execute = AsyncMock(
+        return_value=MagicMock(scalar_one_or_none=MagicMock(return_value=account))
+    )
+    db.commit = AsyncMock()
+    return db
+
+
+# ============================================================================
+# Test get_account_by_id
+# ============================================================================
+
+class TestAccountCache:
+    """Tests for the short-lived account snapshot cache."""
+
+    @pytest.mark.asyncio
+    async def test_second_lookup_hits_cache(self, db, account):
+        """A repeated lookup should return the cached snapshot without a query."""
+        first = await AuthService.get_account_by_id(db, account.id)
+        second = await AuthService.get_account_by_id(db, account.id)
+
+        assert isinstance(first, AccountSnapshot)
+        assert second is first
+        assert db.execute.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_account_not_cached(self, db, account):
+        db.execute.return_value.scalar_one_or_none.return_value = None
+
+        assert await AuthService.get_account_by_id(db, account.id) is None
+        assert await AuthService.get_account_by_id(db, account.id) is None
+        assert db.execute.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_magic_link_mutation_evicts(self, db, account):
+        """Setting a magic link token should force the next lookup to hit the database."""
+        await AuthService.get_account_by_id(db, account.id)
+
+        await AuthService.set_magic_link_token(db, account)
+        account.email_verified = False
+        snapshot = await AuthService.get_account_by_id(db, account.id)
+
+        assert db.execute.await_count == 2
+        assert snapshot.email_verified is False
+
+    @pytest.mark.asyncio
+    async def test_token_pair_evicts(self, db, account):
+        await AuthService.get_account_by_id(db, account.id)
+
+        AuthService.create_token_pair(account)
+        await AuthService.get_account_by_id(db, account.id)
+
+        assert db.execute.await_count == 2
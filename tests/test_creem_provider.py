@@ -0,0 +1,253 @@
+"""Tests for CreemProvider."""
+
+import hashlib
+import hmac
+import json
+
+import pytest
+from dataclasses import replace
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from api.services.creem_provider import CreemProvider
+from api.services.payment_engine import (
+    InvalidSignatureError,
+    PaymentMethod,
+    PaymentRequest,
+    PaymentStatus,
+    WebhookEvent,
+)
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+@pytest.fixture
+def creem_provider():
+    """Create CreemProvider with configured redirect URLs."""
+    return CreemProvider(
+        api_key="test_api_key",
+        product_id="prod_123",
+        webhook_secret="test_webhook_secret",
+        success_url="https://kikuai.dev/webapp/payment/success",
+        cancel_url="https://kikuai.dev/webapp/payment/cancel",
+    )
+
+
+@pytest.fixture
+def payment_request():
+    return PaymentRequest(
+        user_id=12345,
+        amount_usd=Decimal("10.00"),
+        method=PaymentMethod.CREEM,
+        idempotency_key="test_idempotency_key",
+    )
+
+
+def signed_event(data, event_type="checkout.completed", secret="test_webhook_secret", prefix=""):
+    """Build a Creem webhook event signed with HMAC-SHA256 over the raw body."""
+    raw_body = json.dumps({"type": event_type, "data": data}).encode()
+    signature = hmac.new(secret.encode(), raw_body, hashlib.sha256).hexdigest()
+    return WebhookEvent(
+        provider=PaymentMethod.CREEM,
+        event_type=event_type,
+        event_id="evt_1",
+        data=data,
+        raw_body=raw_body,
+        signature=prefix + signature,
+    )
+
+
+def mock_http_client(response):
+    """Patch httpx.AsyncClient to return response from post()."""
+    client = MagicMock()
+    client.post = AsyncMock(return_value=response)
+    client.__aenter__ = AsyncMock(return_value=client)
+    client.__aexit__ = AsyncMock(return_value=False)
+    return patch("api.services.creem_provider.httpx.AsyncClient", return_value=client), client
+
+
+# ============================================================================
+# Test create_checkout
+# ============================================================================
+
+class TestCreateCheckout:
+    """Tests for checkout creation."""
+
+    @pytest.mark.asyncio
+    async def test_configured_urls_used(self, creem_provider, payment_request):
+        """Configured redirect URLs should come from the prepared template."""
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"id": "chk_1", "checkout_url": "https://creem.io/chk_1"}
+        patcher, client = mock_http_client(response)
+
+        with patcher:
+            result = await creem_provider.create_checkout(
+                payment_request,
+                success_url="https://kikuai.dev/webapp/payment/success",
+            )
+
+        assert result.status == PaymentStatus.PENDING
+        body = client.post.call_args.kwargs["json"]
+        assert body["product_id"] == "prod_123"
+        assert body["success_url"] == "https://kikuai.dev/webapp/payment/success"
+        assert body["cancel_url"] == "https://kikuai.dev/webapp/payment/cancel"
+        assert body["metadata"]["credits"] == 10000
+
+    @pytest.mark.asyncio
+    async def test_per_call_url_overrides(self, creem_provider, payment_request):
+        """A different per-call URL should override the configured one."""
+        response = MagicMock(status_code=201)
+        response.json.return_value = {"id": "chk_1"}
+        patcher, client = mock_http_client(response)
+
+        with patcher:
+            await creem_provider.create_checkout(payment_request, success_url="https://example.com/ok")
+
+        assert client.post.call_args.kwargs["json"]["success_url"] == "https://example.com/ok"
+
+
+# ============================================================================
+# Test verify_webhook
+# ============================================================================
+
+class TestVerifyWebhook:
+    """Tests for webhook signature verification."""
+
+    @pytest.mark.asyncio
+    async def test_valid_signature(self, creem_provider):
+        assert await creem_provider.verify_webhook(signed_event({"id": "ord_1"}))
+
+    @pytest.mark.asyncio
+    async def test_sha256_prefix_accepted(self, creem_provider):
+        event = signed_event({"id": "ord_1"}, prefix="sha256=")
+        assert await creem_provider.verify_webhook(event)
+
+    @pytest.mark.asyncio
+    async def test_wrong_secret_rejected(self, creem_provider):
+        event = signed_event({"id": "ord_1"}, secret="other_secret")
+        assert not await creem_provider.verify_webhook(event)
+
+    @pytest.mark.asyncio
+    async def test_non_hex_signature_rejected(self, creem_provider):
+        event = replace(signed_event({"id": "ord_1"}), signature="sha256=not-a-hex-digest")
+        assert not await creem_provider.verify_webhook(event)
+
+
+# ============================================================================
+# Test process_webhook
+# ============================================================================
+
+class TestProcessWebhook:
+    """Tests for crediting completed orders."""
+
+    @pytest.mark.asyncio
+    async def test_amount_cents_scaled_to_usd(self, creem_provider):
+        """A top-level integer cent amount should convert exactly to USD."""
+        event = signed_event({
+            "id": "ord_1",
+            "amount": 1099,
+            "metadata": {"user_id": 12345, "credits": 10990},
+        })
+
+        transaction = await creem_provider.process_webhook(event)
+
+        assert transaction.amount_usd == Decimal("10.99")
+        assert transaction.metadata["items"] == 0
+
+    @pytest.mark.asyncio
+    async def test_credits_fallback_without_amount(self, creem_provider):
+        """Without any amount the credit should be derived from metadata credits."""
+        event = signed_event({
+            "id": "ord_1",
+            "metadata": {"user_id": 12345, "credits": 5000},
+        })
+
+        transaction = await creem_provider.process_webhook(event)
+
+        assert transaction.amount_usd == Decimal("5")
+
+    @pytest.mark.asyncio
+    async def test_line_items_only(self, creem_provider):
+        """A multi-item order without top-level amount or credits should sum its items."""
+        event = signed_event({
+            "id": "ord_1",
+            "metadata": {"user_id": 12345},
+            "items": [
+                {"amount": 500, "metadata": {"credits": 5000}},
+                {"amount": 250, "metadata": {"credits": 2500}},
+            ],
+        })
+
+        transaction = await creem_provider.process_webhook(event)
+
+        assert transaction.amount_usd == Decimal("7.50")
+        assert transaction.metadata["credits"] == 7500
+        assert transaction.metadata["items"] == 2
+
+    @pytest.mark.asyncio
+    async def test_top_level_amount_takes_precedence(self, creem_provider):
+        """Top-level amount and credits should win over line item totals."""
+        event = signed_event({
+            "id": "ord_1",
+            "amount": 900,
+            "metadata": {"user_id": 12345, "credits": 9000},
+            "items": [
+                {"amount": 500, "metadata": {"credits": 5000}},
+                {"amount": 500, "metadata": {"credits": 5000}},
+            ],
+        })
+
+        transaction = await creem_provider.process_webhook(event)
+
+        assert transaction.amount_usd == Decimal("9.00")
+        assert transaction.metadata["credits"] == 9000
+
+    @pytest.mark.asyncio
+    async def test_mixed_top_level_and_items(self, creem_provider):
+        """Missing top-level fields should be filled from the line items."""
+        event = signed_event({
+            "id": "ord_1",
+            "amount": 1200,
+            "metadata": {"user_id": 12345},
+            "items": [
+                {"amount": 700, "metadata": {"credits": 7000}},
+                {"amount": 300, "metadata": {"credits": 3000}},
+            ],
+        })
+
+        transaction = await creem_provider.process_webhook(event)
+
+        assert transaction.amount_usd == Decimal("12.00")
+        assert transaction.metadata["credits"] == 10000
+
+    @pytest.mark.asyncio
+    async def test_balance_service_credited_once(self, creem_provider):
+        """The whole order should be a single balance credit."""
+        balance_service = MagicMock()
+        balance_service.credit_balance = AsyncMock(return_value="txn")
+        creem_provider._balance_service = balance_service
+        event = signed_event({
+            "id": "ord_1",
+            "metadata": {"user_id": 12345},
+            "items": [
+                {"amount": 500, "metadata": {"credits": 5000}},
+                {"amount": 250, "metadata": {"credits": 2500}},
+            ],
+        })
+
+        assert await creem_provider.process_webhook(event) == "txn"
+        balance_service.credit_balance.assert_awaited_once()
+        assert balance_service.credit_balance.call_args.kwargs["amount_usd"] == Decimal("7.50")
+
+    @pytest.mark.asyncio
+    async def test_invalid_signature_raises(self, creem_provider):
+        event = signed_event({"id": "ord_1"}, secret="other_secret")
+        with pytest.raises(InvalidSignatureError):
+            await creem_provider.process_webhook(event)
+
+    @pytest.mark.asyncio
+    async def test_other_event_types_ignored(self, creem_provider):
+        event = signed_event({"id": "ord_1"}, event_type="checkout.expired")
+        assert await creem_provider.process_webhook(event) is None
@@ -2,9 +2,11 @@
 
 import pytest
 import pytest_asyncio
-from datetime import date, datetime
+from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock, patch
 
+from redis.asyncio import Redis
+
 from api.services.free_tier_service import (
     FreeTierService,
     FreeTierLimits,
@@ -40,14 +42,29 @@ class TestFreeTierLimits:
         assert limits.monthly == 10000
 
 
+@pytest.fixture(autouse=True)
+def reset_usage_batching():
+    """Drop write-combining and read-cache state so one test's usage can't leak into another."""
+    from api.services import free_tier_service as fts
+    
+    fts._pending_usage.clear()
+    fts._usage_cache.clear()
+    fts._flush_task = None
+    yield
+    fts._pending_usage.clear()
+    fts._usage_cache.clear()
+    fts._flush_task = None
+
+
 class TestFreeTierService:
     """Tests for FreeTierService with mocked Redis."""
     
     @pytest_asyncio.fixture
     async def mock_redis(self):
-        """Create mock Redis client."""
-        redis = AsyncMock()
+        """Create mock Redis client; the spec rejects commands Redis does not have."""
+        redis = AsyncMock(spec=Redis)
         redis.get = AsyncMock(return_value=None)
+        redis.mget = AsyncMock(return_value=[None, None])
         redis.incrby = AsyncMock(return_value=1)
         redis.expire = AsyncMock()
         redis.pipeline = MagicMock()
@@ -55,6 +72,7 @@ class TestFreeTierService:
         # Pipeline mock
         pipe = AsyncMock()
         pipe.incrby = MagicMock(return_value=pipe)
+        pipe.decrby = MagicMock(return_value=pipe)
         pipe.expire = MagicMock(return_value=pipe)
         pipe.execute = AsyncMock(return_value=[1, 1])
         redis.pipeline.return_value = pipe
@@ -77,7 +95,7 @@ class TestFreeTierService:
     @pytest.mark.asyncio
     async def test_check_limit_exceeded_daily(self, mock_redis):
         """Should deny when daily limit exceeded."""
-        mock_redis.get = AsyncMock(side_effect=["3", "10"])  # 3 daily, 10 monthly
+        mock_redis.mget = AsyncMock(return_value=["3", "10"])  # 3 daily, 10 monthly
         service = FreeTierService(mock_redis)
         
         result = await service.check_limit("chart2csv", "1.2.3.4")
@@ -89,7 +107,7 @@ class TestFreeTierService:
     @pytest.mark.asyncio
     async def test_check_limit_exceeded_monthly(self, mock_redis):
         """Should deny when monthly limit exceeded."""
-        mock_redis.get = AsyncMock(side_effect=["2", "50"])  # 2 daily OK, 50 monthly full
+        mock_redis.mget = AsyncMock(return_value=["2", "50"])  # 2 daily OK, 50 monthly full
         service = FreeTierService(mock_redis)
         
         result = await service.check_limit("chart2csv", "1.2.3.4")
@@ -100,19 +118,59 @@ class TestFreeTierService:
     
     @pytest.mark.asyncio
     async def test_record_usage(self, mock_redis):
-        """Should increment counters atomically."""
+        """Should increment both counters in one script call."""
+        from api.services import free_tier_service as fts
+        
+        fts._SHA_CACHE.clear()
+        mock_redis.script_load = AsyncMock(return_value="sha-record")
+        mock_redis.evalsha = AsyncMock(return_value=[1, 1])
         service = FreeTierService(mock_redis)
         
         daily, monthly = await service.record_usage("masker", "192.168.1.1")
         
         assert daily == 1
         assert monthly == 1
-        mock_redis.pipeline.assert_called_once()
+        mock_redis.script_load.assert_awaited_once_with(fts.RECORD_USAGE_LUA)
+        args = mock_redis.evalsha.call_args.args
+        assert args[:2] == ("sha-record", 2)
+        assert args[4] == 1  # units
+        mock_redis.pipeline.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_check_limit_reads_cached_counts(self, mock_redis):
+        """Repeated checks within the cache TTL should share one MGET."""
+        mock_redis.mget = AsyncMock(return_value=["1", "10"])
+        service = FreeTierService(mock_redis)
+        
+        first = await service.check_limit("chart2csv", "1.2.3.4")
+        second = await service.check_limit("chart2csv", "1.2.3.4")
+        
+        assert first == second
+        mock_redis.mget.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_check_and_record_refreshes_cached_counts(self, mock_redis):
+        """Counts written by check_and_record should be what the next check sees."""
+        from api.services import free_tier_service as fts
+        
+        fts._SHA_CACHE.clear()
+        mock_redis.mget = AsyncMock(return_value=["0", "0"])
+        mock_redis.script_load = AsyncMock(return_value="sha")
+        mock_redis.evalsha = AsyncMock(return_value=[1, 2, 10])
+        service = FreeTierService(mock_redis)
+        
+        await service.check_limit("chart2csv", "1.2.3.4")
+        await service.check_and_record("chart2csv", "1.2.3.4")
+        result = await service.check_limit("chart2csv", "1.2.3.4")
+        
+        assert result.remaining_daily == 1
+        assert result.remaining_monthly == 40
+        mock_redis.mget.assert_awaited_once()
     
     @pytest.mark.asyncio
     async def test_get_remaining(self, mock_redis):
         """Should return usage summary."""
-        mock_redis.get = AsyncMock(side_effect=["5", "100"])  # 5 daily, 100 monthly
+        mock_redis.mget = AsyncMock(return_value=["5", "100"])  # 5 daily, 100 monthly
         service = FreeTierService(mock_redis)
         
         remaining = await service.get_remaining("masker", "test-user")
@@ -124,8 +182,9 @@ class TestFreeTierService:
     
     @pytest.mark.asyncio
     async def test_get_all_remaining(self, mock_redis):
-        """Should return all products."""
-        mock_redis.get = AsyncMock(return_value="0")
+        """Should return all products from a single MGET."""
+        n = len(FREE_TIER_LIMITS)
+        mock_redis.mget = AsyncMock(return_value=["2"] + [None] * (n - 1) + ["60"] + [None] * (n - 1))
         service = FreeTierService(mock_redis)
         
         result = await service.get_all_remaining("test-user")
@@ -134,11 +193,17 @@ class TestFreeTierService:
         assert "masker" in result
         assert "patas" in result
         assert "reliapi" in result
+        assert result["chart2csv"]["used_today"] == 2
+        assert result["chart2csv"]["used_month"] == 50  # capped at limit
+        assert result["masker"]["used_today"] == 0
+        mock_redis.mget.assert_called_once()
+        mock_redis.get.assert_not_called()
+        mock_redis.pipeline.assert_not_called()
     
     @pytest.mark.asyncio
     async def test_units_parameter(self, mock_redis):
         """Should check multiple units at once."""
-        mock_redis.get = AsyncMock(side_effect=["80", "5000"])  # 80 daily, 5000 monthly
+        mock_redis.mget = AsyncMock(return_value=["80", "5000"])  # 80 daily, 5000 monthly
         service = FreeTierService(mock_redis)
         
         # Try to use 30 messages (should exceed 100 daily limit)
@@ -152,7 +217,7 @@ class TestFreeTierService:
         service = FreeTierService(None)
         key = service._daily_key("chart2csv", "1.2.3.4")
         
-        today = date.today().isoformat()
+        today = datetime.utcnow().date().isoformat()
         assert key == f"free:chart2csv:1.2.3.4:daily:{today}"
     
     def test_key_format_monthly(self):
@@ -162,3 +227,303 @@ class TestFreeTierService:
         
         month = datetime.utcnow().strftime("%Y-%m")
         assert key == f"free:masker:user-123:monthly:{month}"
+    
+    @pytest.mark.asyncio
+    async def test_check_and_record_allowed(self, mock_redis):
+        """Should record usage and return remaining from the script result."""
+        mock_redis.script_load = AsyncMock(return_value="sha")
+        mock_redis.evalsha = AsyncMock(return_value=[1, 2, 10])
+        service = FreeTierService(mock_redis)
+        
+        result = await service.check_and_record("chart2csv", "1.2.3.4")
+        
+        assert result.allowed is True
+        assert result.remaining_daily == 1
+        assert result.remaining_monthly == 40
+        mock_redis.evalsha.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_check_and_record_denied(self, mock_redis):
+        """Should report current counts when the script rejects usage."""
+        mock_redis.script_load = AsyncMock(return_value="sha")
+        mock_redis.evalsha = AsyncMock(return_value=[0, 3, 10])
+        service = FreeTierService(mock_redis)
+        
+        result = await service.check_and_record("chart2csv", "1.2.3.4")
+        
+        assert result.allowed is False
+        assert result.remaining_daily == 0
+        assert result.remaining_monthly == 40
+    
+    @pytest.mark.asyncio
+    async def test_record_usage_batched(self, mock_redis):
+        """Batched products accumulate in-process and flush as one pipeline."""
+        from api.services import free_tier_service as fts
+        
+        with patch.object(fts, "BATCHED_PRODUCTS", frozenset({"reliapi"})):
+            service = FreeTierService(mock_redis)
+            await service.record_usage("reliapi", "user-1")
+            daily, monthly = await service.record_usage("reliapi", "user-1", units=2)
+            
+            assert (daily, monthly) == (3, 3)
+            mock_redis.pipeline.assert_not_called()
+            
+            # Pending units count towards the limit before the flush
+            result = await service.check_limit("reliapi", "user-1")
+            assert result.remaining_daily == 997
+            
+            await fts.flush_pending_usage(mock_redis)
+        
+        pipe = mock_redis.pipeline.return_value
+        pipe.incrby.assert_any_call(service._daily_key("reliapi", "user-1"), 3)
+        # TTLs are only set on counters the flush created
+        assert all(c.kwargs == {"nx": True} for c in pipe.expire.call_args_list)
+        pipe.execute.assert_awaited_once()
+        assert fts._pending_usage == {}
+    
+    @pytest.mark.asyncio
+    async def test_stop_usage_flusher(self, mock_redis):
+        """Shutdown should cancel the flush task and still write pending usage."""
+        from api.services import free_tier_service as fts
+        
+        with patch.object(fts, "BATCHED_PRODUCTS", frozenset({"reliapi"})), \
+                patch.object(fts, "_redis_client", mock_redis):
+            service = FreeTierService(mock_redis)
+            await service.record_usage("reliapi", "user-1", units=4)
+            task = fts._flush_task
+            assert task is not None
+            
+            await fts.stop_usage_flusher()
+        
+        assert task.cancelled()
+        assert fts._flush_task is None
+        assert fts._pending_usage == {}
+        pipe = mock_redis.pipeline.return_value
+        pipe.incrby.assert_any_call(service._daily_key("reliapi", "user-1"), 4)
+    
+    def test_progressive_limits(self):
+        """New accounts get half limits (minimum 1) during the progressive period."""
+        service = FreeTierService(None)
+        service.set_account_started_at(datetime.utcnow())
+        
+        assert service._get_limits("chart2csv") == FreeTierLimits(daily=1, monthly=25)
+        assert service._get_limits("unknown") == FreeTierLimits(daily=5, monthly=50)
+        
+        service.set_account_started_at(None)
+        assert service._get_limits("chart2csv") == FREE_TIER_LIMITS["chart2csv"]
+    
+    @pytest.mark.asyncio
+    async def test_check_and_record_reloads_on_noscript(self, mock_redis):
+        """Should reload the script once when Redis reports NOSCRIPT."""
+        from redis.exceptions import NoScriptError
+        from api.services import free_tier_service as fts
+        
+        fts._SHA_CACHE.clear()
+        mock_redis.script_load = AsyncMock(side_effect=["sha-old", "sha-new"])
+        mock_redis.evalsha = AsyncMock(side_effect=[NoScriptError("NOSCRIPT"), [1, 1, 1]])
+        service = FreeTierService(mock_redis)
+        
+        result = await service.check_and_record("masker", "1.2.3.4")
+        
+        assert result.allowed is True
+        assert mock_redis.script_load.await_count == 2
+        assert mock_redis.evalsha.call_args.args[0] == "sha-new"
+    
+    @pytest.mark.asyncio
+    async def test_check_and_record_rolling(self, mock_redis):
+        """With the rolling setting on, the monthly limit is checked over the window with units."""
+        from api.services import free_tier_service as fts
+        
+        fts._SHA_CACHE.clear()
+        mock_redis.script_load = AsyncMock(return_value="sha-rolling")
+        mock_redis.evalsha = AsyncMock(return_value=[1, 5, 40])
+        service = FreeTierService(mock_redis)
+        
+        with patch.object(fts, "FREE_TIER_ROLLING_MONTHLY", True):
+            result = await service.check_and_record("patas", "1.2.3.4", units=5)
+        
+        assert result.allowed is True
+        assert result.remaining_daily == 95
+        assert result.remaining_monthly == 9960
+        mock_redis.script_load.assert_awaited_once_with(fts.CHECK_AND_RECORD_ROLLING_LUA)
+        args = mock_redis.evalsha.call_args.args
+        assert args[1:5] == (
+            3,
+            service._daily_key("patas", "1.2.3.4"),
+            "free:patas:1.2.3.4:rolling",
+            "free:patas:1.2.3.4:rolling:total",
+        )
+        assert args[5:8] == (5, 100, 10000)  # units, daily and monthly limits
+        assert args[10] == fts.ROLLING_WINDOW_SECONDS * 1000
+    
+    @pytest.mark.asyncio
+    async def test_refund_usage_rolling(self, mock_redis):
+        """With the rolling setting on, refunds go through the rolling refund script."""
+        from api.services import free_tier_service as fts
+        
+        fts._SHA_CACHE.clear()
+        mock_redis.script_load = AsyncMock(return_value="sha-refund")
+        mock_redis.evalsha = AsyncMock(return_value=1)
+        service = FreeTierService(mock_redis)
+        
+        with patch.object(fts, "FREE_TIER_ROLLING_MONTHLY", True):
+            await service.refund_usage("patas", "1.2.3.4", units=5)
+        
+        mock_redis.script_load.assert_awaited_once_with(fts.REFUND_ROLLING_LUA)
+        assert mock_redis.evalsha.call_args.args[-1] == 5
+        mock_redis.pipeline.assert_not_called()
+    
+    def test_reset_times(self):
+        """Daily resets at next UTC midnight, monthly on the 1st of next month (Dec rolls the year)."""
+        from api.services.free_tier_service import _build_monthly_resets
+        
+        service = FreeTierService()
+        tomorrow = (datetime.utcnow().date() + timedelta(days=1)).isoformat()
+        assert service._daily_reset_time() == f"{tomorrow}T00:00:00Z"
+        
+        resets = _build_monthly_resets()
+        assert len(resets) == 25
+        december = next(key for key in resets if key[1] == 12)
+        assert resets[december] == f"{december[0] + 1}-01-01T00:00:00Z"
+    
+    @pytest.mark.asyncio
+    async def test_get_many_remaining_chunks_mget(self, mock_redis):
+        """Should batch identifiers into chunked MGETs and reshape per identifier."""
+        products = len(FREE_TIER_LIMITS)
+        mock_redis.mget = AsyncMock(side_effect=lambda keys: ["1"] * len(keys))
+        service = FreeTierService(mock_redis)
+        
+        with patch("api.services.free_tier_service.MANY_REMAINING_CHUNK", 2):
+            result = await service.get_many_remaining(["a", "b", "c"])
+        
+        assert mock_redis.mget.call_count == 2
+        assert len(mock_redis.mget.call_args_list[0].args[0]) == 2 * 2 * products
+        assert set(result) == {"a", "b", "c"}
+        assert result["c"]["masker"]["used_today"] == 1
+        assert result["c"]["masker"]["used_month"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_refund_usage_decrements_both_counters(self, mock_redis):
+        """Refunds should DECRBY the daily and monthly counters by the recorded units."""
+        service = FreeTierService(mock_redis)
+        
+        await service.refund_usage("patas", "1.2.3.4", units=5)
+        
+        mock_redis.pipeline.assert_called_once_with(transaction=False)
+        pipe = mock_redis.pipeline.return_value
+        pipe.decrby.assert_any_call(service._daily_key("patas", "1.2.3.4"), 5)
+        pipe.decrby.assert_any_call(service._monthly_key("patas", "1.2.3.4"), 5)
+        pipe.execute.assert_awaited_once()
+    
+    @pytest.mark.asyncio
+    async def test_refund_usage_swallows_redis_errors(self, mock_redis):
+        """A failed refund must not replace the upstream error being reported."""
+        mock_redis.pipeline.return_value.execute = AsyncMock(side_effect=ConnectionError("down"))
+        service = FreeTierService(mock_redis)
+        
+        await service.refund_usage("masker", "1.2.3.4")
+    
+    @pytest.mark.asyncio
+    async def test_result_to_remaining(self, mock_redis):
+        """The check_and_record result should format like get_remaining."""
+        mock_redis.script_load = AsyncMock(return_value="sha")
+        mock_redis.evalsha = AsyncMock(return_value=[1, 2, 10])
+        service = FreeTierService(mock_redis)
+        
+        result = await service.check_and_record("chart2csv", "1.2.3.4")
+        
+        assert result.to_remaining() == {
+            "used_today": 2,
+            "limit_today": 3,
+            "used_month": 10,
+            "limit_month": 50,
+            "resets_at": result.resets_at_daily,
+        }
+
+
+class TestFreeTierRefundOnFailure:
+    """Tests for giving free tier units back when the upstream call fails."""
+    
+    @pytest.fixture
+    def free_tier(self):
+        from api.services.free_tier_service import FreeTierResult
+        
+        service = MagicMock()
+        service.check_and_record = AsyncMock(return_value=FreeTierResult(
+            allowed=True,
+            remaining_daily=99,
+            remaining_monthly=1999,
+            limit_daily=100,
+            limit_monthly=2000,
+            resets_at_daily="2024-01-02T00:00:00Z",
+            resets_at_monthly="2024-02-01T00:00:00Z",
+        ))
+        service.refund_usage = AsyncMock()
+        service.get_remaining = AsyncMock()
+        with patch("api.routes.masker.FreeTierService", return_value=service):
+            yield service
+    
+    def http_client(self, **post_kwargs):
+        client = MagicMock()
+        client.post = AsyncMock(**post_kwargs)
+        client.__aenter__ = AsyncMock(return_value=client)
+        client.__aexit__ = AsyncMock(return_value=False)
+        return patch("api.routes.masker.httpx.AsyncClient", return_value=client)
+    
+    async def redact(self):
+        from api.routes.masker import RedactRequest, redact_pii
+        
+        return await redact_pii(
+            request=RedactRequest(text="hello"),
+            response=MagicMock(headers={}),
+            x_api_key=None,
+            x_forwarded_for=None,
+            cf_connecting_ip="1.2.3.4",
+            db=MagicMock(),
+            redis=MagicMock(),
+        )
+    
+    @pytest.mark.asyncio
+    async def test_connection_error_refunds(self, free_tier):
+        import httpx
+        from fastapi import HTTPException
+        
+        with self.http_client(side_effect=httpx.ConnectError("refused")):
+            with pytest.raises(HTTPException) as exc_info:
+                await self.redact()
+        
+        assert exc_info.value.status_code == 503
+        free_tier.refund_usage.assert_awaited_once_with("masker", "1.2.3.4")
+    
+    @pytest.mark.asyncio
+    async def test_upstream_error_status_refunds(self, free_tier):
+        from fastapi import HTTPException
+        
+        upstream = MagicMock(status_code=500, headers={}, text="boom")
+        with self.http_client(return_value=upstream):
+            with pytest.raises(HTTPException) as exc_info:
+                await self.redact()
+        
+        assert exc_info.value.status_code == 500
+        free_tier.refund_usage.assert_awaited_once_with("masker", "1.2.3.4")
+    
+    @pytest.mark.asyncio
+    async def test_unparseable_body_refunds(self, free_tier):
+        upstream = MagicMock(status_code=200)
+        upstream.json.side_effect = ValueError("not json")
+        with self.http_client(return_value=upstream):
+            with pytest.raises(ValueError):
+                await self.redact()
+        
+        free_tier.refund_usage.assert_awaited_once_with("masker", "1.2.3.4")
+    
+    @pytest.mark.asyncio
+    async def test_success_uses_recorded_result(self, free_tier):
+        upstream = MagicMock(status_code=200)
+        upstream.json.return_value = {"text": "*****"}
+        with self.http_client(return_value=upstream):
+            result = await self.redact()
+        
+        assert result["free_tier"]["used_today"] == 1
+        free_tier.refund_usage.assert_not_awaited()
+        free_tier.get_remaining.assert_not_awaited()
@@ -0,0 +1,124 @@
+"""Tests for LedgerBalanceService.record_usage branching."""
+
+import pytest
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+from api.services.ledger_balance import LedgerBalanceService, RECORD_USAGE_SQL
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+def usage_row(account_id=None, claimed=True, new_balance=None, current_balance=Decimal("1.00")):
+    """Row shaped like the RECORD_USAGE_SQL result."""
+    return MagicMock(
+        account_id=account_id,
+        claimed=claimed,
+        new_balance=new_balance,
+        current_balance=current_balance,
+        auto_recharge_threshold=None,
+    )
+
+
+def usage_result(**kwargs):
+    """Execute result whose .one() returns a usage_row."""
+    return MagicMock(one=MagicMock(return_value=usage_row(**kwargs)))
+
+
+@pytest.fixture
+def session():
+    session = MagicMock()
+    session.execute = AsyncMock()
+    session.commit = AsyncMock()
+    session.rollback = AsyncMock()
+    return session
+
+
+@pytest.fixture
+def ledger(session):
+    ledger = LedgerBalanceService(session)
+    with patch.object(ledger, "_cache_balance", AsyncMock()):
+        yield ledger
+
+
+async def record(ledger, cost=Decimal("0.25")):
+    return await ledger.record_usage(
+        telegram_id=12345,
+        product_id="masker",
+        units=1,
+        cost=cost,
+        idempotency_key="usage:1",
+    )
+
+
+# ============================================================================
+# Test record_usage
+# ============================================================================
+
+class TestRecordUsage:
+    """Tests for the single-statement usage debit."""
+
+    def test_statement_bind_names(self):
+        """The CTE should compile with the parameters record_usage passes."""
+        assert set(RECORD_USAGE_SQL.compile().params) == {
+            "telegram_id", "tx_id", "log_id", "cost", "units", "product_id",
+            "idempotency_key", "description", "metadata",
+        }
+
+    @pytest.mark.asyncio
+    async def test_success_commits(self, ledger, session):
+        """A covered charge should commit and return the new balance."""
+        session.execute.return_value = usage_result(
+            account_id=uuid4(), new_balance=Decimal("0.75")
+        )
+
+        assert await record(ledger) == Decimal("0.75")
+        session.commit.assert_awaited_once()
+        session.rollback.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_retry_returns_current_balance(self, ledger, session):
+        """A reused idempotency key should roll back and return the current balance."""
+        session.execute.return_value = usage_result(
+            account_id=uuid4(), claimed=False, current_balance=Decimal("0.75")
+        )
+
+        assert await record(ledger) == Decimal("0.75")
+        session.rollback.assert_awaited_once()
+        session.commit.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_insufficient_balance_raises(self, ledger, session):
+        """An uncovered charge should roll back the claimed row and raise BALANCE_EXHAUSTED."""
+        session.execute.return_value = usage_result(account_id=uuid4(), new_balance=None)
+
+        with pytest.raises(ValueError) as exc_info:
+            await record(ledger)
+        assert exc_info.value.args[1] == "BALANCE_EXHAUSTED"
+        session.rollback.assert_awaited_once()
+        session.commit.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_missing_account_raises(self, ledger, session):
+        """An unknown Telegram ID should raise ACCOUNT_NOT_FOUND without writing anything."""
+        session.execute.return_value = usage_result(account_id=None)
+
+        with pytest.raises(ValueError) as exc_info:
+            await record(ledger)
+        assert exc_info.value.args[1] == "ACCOUNT_NOT_FOUND"
+        session.rollback.assert_awaited_once()
+        session.commit.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_cost_rounded_to_eight_places(self, ledger, session):
+        """The cost bound into the statement should use Banker's Rounding at 1e-8."""
+        session.execute.return_value = usage_result(
+            account_id=uuid4(), new_balance=Decimal("0.5")
+        )
+
+        await record(ledger, cost=Decimal("0.000000125"))
+
+        assert session.execute.call_args.args[1]["cost"] == Decimal("0.00000012")
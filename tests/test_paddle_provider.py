@@ -7,6 +7,7 @@ import json
 import time
 import hashlib
 import hmac
+from dataclasses import replace
 
 from api.services.payment_engine import (
     PaddleProvider,
@@ -114,6 +115,16 @@ class TestVerifyWebhook:
         result = await paddle_provider.verify_webhook(event)
         assert result is False
     
+    @pytest.mark.asyncio
+    async def test_malformed_signature(self, paddle_provider, webhook_secret):
+        """Test a non-hex or truncated h1 value is rejected without computing an HMAC."""
+        event = create_signed_webhook({"data": {"id": "txn_123"}}, webhook_secret)
+        timestamp = event.signature.split(";")[0]
+        
+        for h1 in ("z" * 64, "ab" * 16):
+            bad = replace(event, signature=f"{timestamp};h1={h1}")
+            assert await paddle_provider.verify_webhook(bad) is False
+    
     @pytest.mark.asyncio
     async def test_expired_timestamp(self, paddle_provider, webhook_secret):
         """Test webhook with old timestamp is rejected."""
@@ -164,8 +175,6 @@ class TestProcessWebhook:
             }
         }
         event = create_signed_webhook(data, webhook_secret)
-        event.event_type = "transaction.completed"
-        event.data = data["data"]
         
         transaction = await paddle_provider.process_webhook(event)
         
@@ -190,8 +199,6 @@ class TestProcessWebhook:
             }
         }
         event = create_signed_webhook(data, webhook_secret, "transaction.refunded")
-        event.event_type = "transaction.refunded"
-        event.data = data["data"]
         
         transaction = await paddle_provider.process_webhook(event)
         
@@ -199,7 +206,34 @@ class TestProcessWebhook:
         assert transaction.user_id == 12345
         assert transaction.amount_usd == Decimal("-5.00")  # Negative for refund
         assert transaction.type == TransactionType.REFUND
-    
+
+    @pytest.mark.asyncio
+    async def test_refund_with_object_custom_data(self, paddle_provider, webhook_secret):
+        """Refunds should accept custom_data sent as an object, like completions do."""
+        data = {
+            "data": {
+                "id": "txn_paddle_refund",
+                "custom_data": {"user_id": "12345"},
+                "details": {"totals": {"total": "500"}},
+            }
+        }
+        event = create_signed_webhook(data, webhook_secret, "transaction.refunded")
+
+        transaction = await paddle_provider.process_webhook(event)
+
+        assert transaction is not None
+        assert transaction.user_id == 12345
+
+    @pytest.mark.parametrize("raw, expected", [
+        ('{"user_id": "1"}', {"user_id": "1"}),
+        ({"user_id": "1"}, {"user_id": "1"}),
+        ("not json", {}),
+        ("[1, 2]", {}),
+        (None, {}),
+    ])
+    def test_parse_custom_data(self, raw, expected):
+        assert PaddleProvider._parse_custom_data(raw) == expected
+
     @pytest.mark.asyncio
     async def test_payment_failed(self, paddle_provider, webhook_secret):
         """Test processing of transaction.payment_failed event."""
@@ -211,8 +245,6 @@ class TestProcessWebhook:
             }
         }
         event = create_signed_webhook(data, webhook_secret, "transaction.payment_failed")
-        event.event_type = "transaction.payment_failed"
-        event.data = data["data"]
         
         # Should return None (no transaction to record)
         transaction = await paddle_provider.process_webhook(event)
@@ -223,8 +255,6 @@ class TestProcessWebhook:
         """Test processing of unknown event type."""
         data = {"data": {"id": "test"}}
         event = create_signed_webhook(data, webhook_secret, "subscription.created")
-        event.event_type = "subscription.created"
-        event.data = data["data"]
         
         transaction = await paddle_provider.process_webhook(event)
         assert transaction is None
@@ -259,6 +289,13 @@ class TestCreateCheckout:
         assert result.payment_id == "txn_123"
         assert result.status == PaymentStatus.PENDING
         assert result.checkout_url == "https://checkout.paddle.com/123"
+        body = json.loads(mock_request.call_args.kwargs["content"])
+        assert body["items"] == [{"price_id": PaddleProvider.PRICE_TIERS[10], "quantity": 1}]
+        assert body["custom_data"] == {
+            "user_id": "12345",
+            "idempotency_key": "test_idempotency_key",
+            "amount_usd": "10.00",
+        }
     
     @pytest.mark.asyncio
     async def test_create_checkout_api_error(self, paddle_provider, payment_request):
@@ -273,6 +310,55 @@ class TestCreateCheckout:
                     cancel_url="https://example.com/cancel",
                 )
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("amount", ["9.99", "10.50", "7"])
+    async def test_unsupported_amount_rejected(self, paddle_provider, amount):
+        """Amounts without an exact price tier should fail without calling the API."""
+        request = PaymentRequest(
+            user_id=12345,
+            amount_usd=Decimal(amount),
+            method=PaymentMethod.PADDLE,
+        )
+
+        with patch.object(paddle_provider, "_request_with_retry", new_callable=AsyncMock) as mock_request:
+            result = await paddle_provider.create_checkout(
+                request=request,
+                success_url="https://example.com/success",
+                cancel_url="https://example.com/cancel",
+            )
+
+        assert result.status == PaymentStatus.FAILED
+        assert "not supported" in result.error
+        mock_request.assert_not_awaited()
+
+
+# ============================================================================
+# Test refund
+# ============================================================================
+
+class TestRefund:
+    """Tests for refund adjustments."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("amount, cents", [("9.99", "999"), ("9.995", "1000"), ("5", "500")])
+    async def test_partial_refund_rounds_to_cent(self, paddle_provider, amount, cents):
+        """Partial refund amounts should round half-up to whole cents, not truncate."""
+        with patch.object(paddle_provider, "_request_with_retry", new_callable=AsyncMock) as mock_request:
+            assert await paddle_provider.refund("txn_123", Decimal(amount))
+
+        payload = mock_request.call_args.kwargs["json"]
+        assert payload["type"] == "partial"
+        assert payload["items"][0]["amount"] == cents
+
+    @pytest.mark.asyncio
+    async def test_full_refund(self, paddle_provider):
+        with patch.object(paddle_provider, "_request_with_retry", new_callable=AsyncMock) as mock_request:
+            assert await paddle_provider.refund("txn_123")
+
+        payload = mock_request.call_args.kwargs["json"]
+        assert payload["type"] == "full"
+        assert "items" not in payload
+
 
 # ============================================================================
 # Test get_payment_status
@@ -0,0 +1,507 @@
+"""Tests for PaymentEngine orchestration."""
+
+import asyncio
+import pytest
+import pytest_asyncio
+from dataclasses import replace
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from api.services.payment_engine import (
+    BalanceManager,
+    BatchedIdempotencyCache,
+    DuplicatePaymentError,
+    IDEMPOTENCY_PROCESSING_TTL,
+    InsufficientBalanceError,
+    NotificationDispatcher,
+    PaymentEngine,
+    PaymentError,
+    PaymentMethod,
+    PaymentRequest,
+    Transaction,
+    TransactionType,
+    WebhookEvent,
+)
+
+
+# ============================================================================
+# Fixtures
+# ============================================================================
+
+@pytest.fixture
+def balance_manager():
+    """Balance manager with every backend call mocked."""
+    manager = MagicMock(spec=BalanceManager)
+    manager.get_balance = AsyncMock(return_value=Decimal("10.00"))
+    manager.update_balance = AsyncMock(return_value=Decimal("20.00"))
+    manager.check_idempotency = AsyncMock(return_value=None)
+    manager.check_idempotency_many = AsyncMock(return_value={})
+    manager.try_claim_idempotency = AsyncMock(return_value=None)
+    manager.complete_idempotency = AsyncMock()
+    manager.release_idempotency = AsyncMock()
+
+    async def update_balance_batch(items):
+        # Batched updates go through the default per-item loop onto update_balance
+        return await BalanceManager.update_balance_batch(manager, items)
+
+    manager.update_balance_batch = AsyncMock(side_effect=update_balance_batch)
+    return manager
+
+
+@pytest.fixture
+def provider():
+    """Provider that accepts every webhook and returns a top-up."""
+    provider = MagicMock()
+    provider.verify_webhook = AsyncMock(return_value=True)
+    provider.process_webhook = AsyncMock(return_value=Transaction(
+        id="txn_1",
+        user_id=12345,
+        type=TransactionType.TOPUP,
+        amount_usd=Decimal("10.00"),
+        balance_before=Decimal("0"),
+        balance_after=Decimal("10.00"),
+        source="paddle",
+    ))
+    return provider
+
+
+@pytest_asyncio.fixture
+async def engine(balance_manager, provider):
+    """PaymentEngine with a mocked Paddle provider registered."""
+    engine = PaymentEngine(balance_manager, MagicMock(
+        notify_payment_success=AsyncMock(),
+        notify_low_balance=AsyncMock(),
+    ))
+    engine.register_provider(PaymentMethod.PADDLE, provider)
+    yield engine
+    await engine.close()
+
+
+@pytest.fixture
+def webhook_event():
+    return WebhookEvent(
+        provider=PaymentMethod.PADDLE,
+        event_type="transaction.completed",
+        event_id="evt_123",
+        data={},
+        raw_body=b"{}",
+        signature="sig",
+    )
+
+
+# ============================================================================
+# Test PaymentRequest
+# ============================================================================
+
+class TestPaymentRequest:
+    """Tests for request validation and unit conversion."""
+
+    def test_amount_cents(self):
+        """The USD amount should be converted to integer cents once."""
+        request = PaymentRequest(user_id=1, amount_usd=Decimal("10.50"), method=PaymentMethod.PADDLE)
+        assert request.amount_cents == 1050
+
+    def test_sub_cent_amount_truncated(self):
+        """Sub-cent amounts should truncate, keeping $9.995 on the $9 tier."""
+        request = PaymentRequest(user_id=1, amount_usd=Decimal("9.995"), method=PaymentMethod.PADDLE)
+        assert request.amount_cents == 999
+        assert request.amount_cents // 100 == 9
+
+    def test_non_positive_amount_rejected(self):
+        with pytest.raises(ValueError):
+            PaymentRequest(user_id=1, amount_usd=Decimal("0"), method=PaymentMethod.PADDLE)
+
+
+# ============================================================================
+# Test BatchedIdempotencyCache
+# ============================================================================
+
+class TestBatchedIdempotencyCache:
+    """Tests for idempotency lookup coalescing."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_checks_share_one_lookup(self, balance_manager):
+        """Concurrent checks should be resolved by a single batched lookup."""
+        balance_manager.check_idempotency_many.return_value = {"evt_2": {"processed": True}}
+        cache = BatchedIdempotencyCache(balance_manager)
+
+        results = await asyncio.gather(
+            cache.check("evt_1"),
+            cache.check("evt_2"),
+            cache.check("evt_2"),
+        )
+
+        assert results == [None, {"processed": True}, {"processed": True}]
+        balance_manager.check_idempotency_many.assert_awaited_once_with(["evt_1", "evt_2"])
+
+    @pytest.mark.asyncio
+    async def test_lookup_error_propagates(self, balance_manager):
+        """A failed batch lookup should fail every waiting check."""
+        balance_manager.check_idempotency_many.side_effect = RuntimeError("db down")
+        cache = BatchedIdempotencyCache(balance_manager)
+
+        with pytest.raises(RuntimeError):
+            await cache.check("evt_1")
+
+
+class TestNotificationDispatcher:
+    """Tests for background notification delivery."""
+
+    @pytest.mark.asyncio
+    async def test_webhook_returns_before_notification_sent(self, engine, webhook_event):
+        """process_webhook should not wait on the notification backend."""
+        sent = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow_notify(**kwargs):
+            sent.set()
+            await release.wait()
+
+        engine.notifications.notify_payment_success = AsyncMock(side_effect=slow_notify)
+
+        transaction = await engine.process_webhook(webhook_event)
+
+        assert transaction is not None
+        await asyncio.wait_for(sent.wait(), 1)
+        release.set()
+        await engine.close()
+        engine.notifications.notify_payment_success.assert_awaited_once_with(
+            user_id=12345,
+            amount=Decimal("10.00"),
+            new_balance=Decimal("20.00"),
+        )
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops(self):
+        """A full queue should drop the notification instead of blocking."""
+        notifications = MagicMock(notify_low_balance=AsyncMock())
+        dispatcher = NotificationDispatcher(notifications, workers=1, maxsize=1)
+
+        dispatcher.submit("notify_low_balance", user_id=1, current_balance=Decimal("1"))
+        dispatcher.submit("notify_low_balance", user_id=2, current_balance=Decimal("1"))
+        await dispatcher.close()
+
+        notifications.notify_low_balance.assert_awaited_once_with(
+            user_id=1, current_balance=Decimal("1")
+        )
+
+    @pytest.mark.asyncio
+    async def test_failed_notification_does_not_stop_worker(self):
+        notifications = MagicMock(
+            notify_low_balance=AsyncMock(side_effect=[RuntimeError("telegram down"), None])
+        )
+        dispatcher = NotificationDispatcher(notifications, workers=1)
+
+        dispatcher.submit("notify_low_balance", user_id=1, current_balance=Decimal("1"))
+        dispatcher.submit("notify_low_balance", user_id=2, current_balance=Decimal("1"))
+        await dispatcher.close()
+
+        assert notifications.notify_low_balance.await_count == 2
+
+
+# ============================================================================
+# Test process_webhook
+# ============================================================================
+
+class TestProcessWebhook:
+    """Tests for webhook idempotency handling."""
+
+    @pytest.mark.asyncio
+    async def test_claims_then_completes(self, engine, balance_manager, webhook_event):
+        """A new event should be claimed, credited and marked completed."""
+        transaction = await engine.process_webhook(webhook_event)
+
+        assert transaction.id == "txn_1"
+        balance_manager.try_claim_idempotency.assert_awaited_once()
+        balance_manager.update_balance.assert_awaited_once()
+        record = balance_manager.complete_idempotency.call_args.args[1]
+        assert record["status"] == "completed"
+        assert record["transaction"]["id"] == "txn_1"
+
+    @pytest.mark.asyncio
+    async def test_claimed_event_skipped(self, engine, balance_manager, provider, webhook_event):
+        """An event already claimed by another delivery should not be credited."""
+        balance_manager.try_claim_idempotency.return_value = {"status": "processing"}
+
+        assert await engine.process_webhook(webhook_event) is None
+        provider.process_webhook.assert_not_awaited()
+        balance_manager.update_balance.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_failure_releases_claim(self, engine, balance_manager, webhook_event):
+        """A failed credit should release the claim so the provider can retry."""
+        balance_manager.update_balance.side_effect = RuntimeError("db down")
+
+        with pytest.raises(RuntimeError):
+            await engine.process_webhook(webhook_event)
+        balance_manager.release_idempotency.assert_awaited_once_with("evt_123")
+
+    @pytest.mark.asyncio
+    async def test_ledger_duplicate_ignored(self, engine, balance_manager, webhook_event):
+        """A redelivery already in the ledger should be ignored, not retried."""
+        balance_manager.update_balance.side_effect = DuplicatePaymentError("evt_123")
+
+        assert await engine.process_webhook(webhook_event) is None
+        balance_manager.complete_idempotency.assert_awaited_once()
+        balance_manager.release_idempotency.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_credits_batched(self, engine, balance_manager, webhook_event):
+        """Concurrent deliveries from one provider should share one batched update."""
+        from dataclasses import replace
+        other_event = replace(webhook_event, event_id="evt_456")
+
+        await asyncio.gather(
+            engine.process_webhook(webhook_event),
+            engine.process_webhook(other_event),
+        )
+
+        balance_manager.update_balance_batch.assert_awaited_once()
+        items = balance_manager.update_balance_batch.call_args.args[0]
+        assert [item[3] for item in items] == ["evt_123", "evt_456"]
+
+    @pytest.mark.asyncio
+    async def test_short_batch_result_fails_waiters(self, engine, balance_manager, webhook_event):
+        """A backend returning too few results must fail the webhook, not hang it."""
+        balance_manager.update_balance_batch = AsyncMock(return_value=[])
+
+        with pytest.raises(PaymentError):
+            await asyncio.wait_for(engine.process_webhook(webhook_event), timeout=1)
+        balance_manager.release_idempotency.assert_awaited_once_with("evt_123")
+
+    @pytest.mark.asyncio
+    async def test_missing_event_id_uses_body_digest(self, engine, balance_manager, webhook_event):
+        """Deliveries without an event id should dedupe on a digest of the body."""
+        webhook_event = replace(webhook_event, event_id="")
+
+        await engine.process_webhook(webhook_event)
+
+        key = balance_manager.try_claim_idempotency.call_args.args[0]
+        assert key == webhook_event.dedup_key
+        assert len(key) == 32
+        assert balance_manager.update_balance.call_args.args[3] == key
+
+
+# ============================================================================
+# Test charge_usage
+# ============================================================================
+
+class TestChargeUsage:
+    """Tests for usage charging."""
+
+    @pytest.mark.asyncio
+    async def test_charge_uses_atomic_debit(self, engine, balance_manager):
+        """A covered charge should debit once without a prior balance read."""
+        balance_manager.debit_atomic = AsyncMock(return_value=(Decimal("10.00"), Decimal("9.50")))
+
+        transaction = await engine.charge_usage(12345, Decimal("0.50"), "masker", {})
+
+        assert transaction.amount_usd == Decimal("-0.50")
+        assert transaction.balance_before == Decimal("10.00")
+        assert transaction.balance_after == Decimal("9.50")
+        balance_manager.get_balance.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_insufficient_balance_raises(self, engine, balance_manager):
+        """A refused debit should raise InsufficientBalanceError with the current balance."""
+        balance_manager.debit_atomic = AsyncMock(return_value=None)
+        balance_manager.get_balance.return_value = Decimal("0.10")
+
+        with pytest.raises(InsufficientBalanceError) as exc_info:
+            await engine.charge_usage(12345, Decimal("0.50"), "masker", {})
+        assert exc_info.value.current == Decimal("0.10")
+
+
+# ============================================================================
+# Test PostgresBalanceManager idempotency claims
+# ============================================================================
+
+class TestIdempotencyClaim:
+    """Tests for the Redis-backed idempotency claim."""
+
+    @pytest.fixture
+    def pipe(self):
+        pipe = MagicMock()
+        pipe.execute = AsyncMock()
+        redis_client = MagicMock()
+        redis_client.pipeline.return_value = pipe
+        with patch("api.services.postgres_balance_manager.redis_client", redis_client):
+            yield pipe
+
+    @pytest.mark.asyncio
+    async def test_claim_succeeds(self, pipe):
+        """A fresh key should be claimed in a single MULTI/EXEC."""
+        from api.services.postgres_balance_manager import PostgresBalanceManager
+        pipe.execute.return_value = [True, '{"status": "processing"}']
+
+        assert await PostgresBalanceManager().try_claim_idempotency("evt_1") is None
+        pipe.execute.assert_awaited_once()
+        assert pipe.set.call_args.kwargs["ex"] == IDEMPOTENCY_PROCESSING_TTL
+
+    @pytest.mark.asyncio
+    async def test_duplicate_returns_record(self, pipe):
+        """A claimed key should return the stored record from the same round trip."""
+        from api.services.postgres_balance_manager import PostgresBalanceManager
+        pipe.execute.return_value = [None, '{"status": "completed"}']
+
+        record = await PostgresBalanceManager().try_claim_idempotency("evt_1")
+
+        assert record == {"status": "completed"}
+
+
+# ============================================================================
+# Test provider registry
+# ============================================================================
+
+class TestProviderRegistry:
+    """Tests for provider registration and lookup."""
+
+    def test_registered_provider_returned(self, engine, provider):
+        assert engine.get_provider(PaymentMethod.PADDLE) is provider
+
+    def test_unregistered_provider_raises(self, engine):
+        with pytest.raises(PaymentError):
+            engine.get_provider(PaymentMethod.TELEGRAM_STARS)
+
+    @pytest.mark.asyncio
+    async def test_webhook_for_unregistered_provider_raises(self, engine, webhook_event):
+        webhook_event = replace(webhook_event, provider=PaymentMethod.TELEGRAM_STARS)
+        with pytest.raises(PaymentError):
+            await engine.process_webhook(webhook_event)
+
+    @pytest.mark.asyncio
+    async def test_reregistered_provider_handles_webhooks(self, engine, provider, webhook_event):
+        """Registering again should rebind the webhook handler to the new provider."""
+        replacement = MagicMock(
+            verify_webhook=AsyncMock(return_value=True),
+            process_webhook=AsyncMock(return_value=None),
+        )
+        engine.register_provider(PaymentMethod.PADDLE, replacement)
+
+        assert await engine.process_webhook(webhook_event) is None
+        replacement.process_webhook.assert_awaited_once_with(webhook_event)
+        provider.process_webhook.assert_not_awaited()
+
+
+# ============================================================================
+# Test PostgresBalanceManager balance cache
+# ============================================================================
+
+class TestBalanceCache:
+    """Tests for the per-process balance cache."""
+
+    @pytest.mark.asyncio
+    async def test_update_evicts_and_publishes(self):
+        """Updating a balance should drop the local entry and notify other workers."""
+        from api.services import postgres_balance_manager as pbm
+
+        redis_client = MagicMock()
+        redis_client.publish = AsyncMock()
+        pbm._balance_cache[12345] = Decimal("10.00")
+        manager = pbm.PostgresBalanceManager(db_session=MagicMock())
+
+        with patch.object(pbm, "redis_client", redis_client), \
+                patch.object(manager, "_do_update", AsyncMock(return_value=Decimal("20.00"))):
+            assert await manager.get_balance(12345) == Decimal("10.00")  # served from cache
+            await manager.update_balance(12345, Decimal("10.00"), MagicMock(), "key")
+            await asyncio.sleep(0)  # let the background publish run
+
+        assert 12345 not in pbm._balance_cache
+        redis_client.publish.assert_awaited_once_with(pbm.BALANCE_INVALIDATE_CHANNEL, "12345")
+
+
+
+# ============================================================================
+# Test LedgerBalanceService.add_funds_many
+# ============================================================================
+
+class TestAddFundsMany:
+    """Tests for batched top-ups in the ledger."""
+
+    @pytest.mark.asyncio
+    async def test_credits_and_duplicates(self):
+        """Inserted keys get the account balance; skipped keys report a duplicate."""
+        from api.services.ledger_balance import LedgerBalanceService, ADD_FUNDS_MANY_SQL
+
+        rows = [MagicMock(idempotency_key="evt_1", telegram_id=1, balance_usd=Decimal("15"))]
+        session = MagicMock()
+        session.execute = AsyncMock(side_effect=[MagicMock(), MagicMock(all=MagicMock(return_value=rows))])
+        session.commit = AsyncMock()
+        ledger = LedgerBalanceService(session)
+
+        results = await ledger.add_funds_many(
+            [(1, Decimal("5"), "evt_1", "Top up"), (2, Decimal("5"), "evt_2", "Top up")],
+            commit=False,
+        )
+
+        assert results[0] == Decimal("15")
+        assert isinstance(results[1], ValueError)
+        session.commit.assert_not_awaited()
+        statement, params = session.execute.call_args.args
+        assert statement is ADD_FUNDS_MANY_SQL
+        assert params["idempotency_keys"] == ["evt_1", "evt_2"]
+        assert set(ADD_FUNDS_MANY_SQL.compile().params) == {
+            "telegram_ids", "amounts", "idempotency_keys", "descriptions", "tx_ids",
+        }
+
+    @pytest.mark.asyncio
+    async def test_single_add_funds_uses_batch_statement(self):
+        """add_funds should credit through the CTE and raise on a reused key."""
+        from api.services.ledger_balance import LedgerBalanceService, ADD_FUNDS_MANY_SQL
+
+        rows = [MagicMock(idempotency_key="evt_1", telegram_id=1, balance_usd=Decimal("15"))]
+        session = MagicMock()
+        session.execute = AsyncMock(side_effect=[
+            MagicMock(), MagicMock(all=MagicMock(return_value=rows)),
+            MagicMock(), MagicMock(all=MagicMock(return_value=[])),
+        ])
+        session.commit = AsyncMock()
+        ledger = LedgerBalanceService(session)
+
+        with patch.object(ledger, "_cache_balance", AsyncMock()) as cache_balance:
+            assert await ledger.add_funds(1, Decimal("5"), "evt_1") == Decimal("15")
+            with pytest.raises(ValueError, match="already processed"):
+                await ledger.add_funds(1, Decimal("5"), "evt_1")
+
+        assert session.execute.call_args_list[1].args[0] is ADD_FUNDS_MANY_SQL
+        assert session.commit.await_count == 2
+        cache_balance.assert_awaited_once_with(1, Decimal("15"))
+
+
+# ============================================================================
+# Test ledger Redis circuit breaker
+# ============================================================================
+
+class TestCircuitBreaker:
+    """Tests for the ledger's Redis circuit breaker."""
+
+    def test_trip_logs_critical_once(self, caplog):
+        from api.services.ledger_balance import _CircuitBreaker
+
+        breaker = _CircuitBreaker(threshold=2, recovery_time=60)
+        with caplog.at_level("CRITICAL", logger="api.services.ledger_balance"):
+            for _ in range(3):
+                breaker.record_failure(RuntimeError("down"))
+
+        assert not breaker.allow()
+        assert len([r for r in caplog.records if r.levelname == "CRITICAL"]) == 1
+
+
+    @pytest.mark.asyncio
+    async def test_listener_reconnects(self):
+        """The invalidation listener should resubscribe after a dropped connection."""
+        from api.services import postgres_balance_manager as pbm
+
+        pubsub = MagicMock()
+        pubsub.subscribe = AsyncMock(side_effect=[ConnectionError("down"), asyncio.CancelledError()])
+        pubsub.close = AsyncMock()
+        redis_client = MagicMock()
+        redis_client.pubsub.return_value = pubsub
+
+        with patch.object(pbm, "redis_client", redis_client), \
+                patch.object(pbm.asyncio, "sleep", AsyncMock()) as sleep:
+            with pytest.raises(asyncio.CancelledError):
+                await pbm.listen_for_balance_invalidations()
+
+        assert pubsub.subscribe.await_count == 2
+        sleep.assert_awaited_once_with(1.0)
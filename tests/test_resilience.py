@@ -4,8 +4,11 @@ import pytest
 import httpx
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from api.services.payment_engine import PaddleProvider, PaymentRequest, PaymentMethod, ProviderError
+from email.utils import format_datetime
+import time
+from api.services.payment_engine import PaddleProvider, PaymentRequest, PaymentMethod, ProviderError, _parse_retry_after, _TokenBucket
 
 @pytest.mark.asyncio
 async def test_paddle_rate_limit_retry():
@@ -23,7 +26,7 @@ async def test_paddle_rate_limit_retry():
     
     mock_resp_200 = MagicMock(spec=httpx.Response)
     mock_resp_200.status_code = 200
-    mock_resp_200.json.return_value = {"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}
+    mock_resp_200.content = b'{"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}'
     
     mock_client.request.side_effect = [mock_resp_429, mock_resp_200]
     
@@ -35,6 +38,8 @@ async def test_paddle_rate_limit_retry():
         assert result.payment_id == "txn_123"
         assert mock_client.request.call_count == 2
         mock_sleep.assert_called_with(0)
+        # The 429 halves the client-side request rate
+        assert provider._limiter.rate == PaddleProvider.RATE_LIMIT / 2
 
 @pytest.mark.asyncio
 async def test_paddle_server_error_retry():
@@ -59,6 +64,121 @@ async def test_paddle_server_error_retry():
         assert mock_client.request.call_count == 3
         assert mock_sleep.call_count == 2
 
+@pytest.mark.asyncio
+async def test_paddle_backoff_jittered_and_capped():
+    """Retry delays should grow exponentially, carry jitter and stop at MAX_DELAY."""
+    provider = PaddleProvider(api_key="test_key", webhook_secret="test_secret")
+    
+    with patch("api.services.payment_engine.random.random", return_value=1.0):
+        assert provider._backoff_delay(0) == 1.5
+        assert provider._backoff_delay(2) == 6.0
+        assert provider._backoff_delay(10) == PaddleProvider.MAX_DELAY
+    with patch("api.services.payment_engine.random.random", return_value=0.0):
+        assert provider._backoff_delay(1) == 2.0
+
+@pytest.mark.asyncio
+async def test_paddle_rate_limit_without_retry_after_backs_off():
+    """A 429 without Retry-After should use the jittered backoff, not a fixed 5s."""
+    provider = PaddleProvider(api_key="test_key", webhook_secret="test_secret")
+    
+    mock_client = AsyncMock()
+    provider._client = mock_client
+    
+    mock_resp_429 = MagicMock(spec=httpx.Response)
+    mock_resp_429.status_code = 429
+    mock_resp_429.headers = {}
+    
+    mock_resp_200 = MagicMock(spec=httpx.Response)
+    mock_resp_200.status_code = 200
+    mock_resp_200.content = b'{"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}'
+    
+    mock_client.request.side_effect = [mock_resp_429, mock_resp_200]
+    
+    with patch("asyncio.sleep", AsyncMock()) as mock_sleep, \
+            patch("api.services.payment_engine.random.random", return_value=0.5):
+        request = PaymentRequest(user_id=123, amount_usd=Decimal("10"), method=PaymentMethod.PADDLE)
+        result = await provider.create_checkout(request, "https://success", "https://cancel")
+        
+        assert result.is_success
+        mock_sleep.assert_called_with(1.25)
+
+def test_parse_retry_after_forms():
+    """Retry-After accepts delta-seconds and HTTP-dates; junk is ignored."""
+    assert _parse_retry_after("7") == 7.0
+    assert _parse_retry_after("-3") == 0.0
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("soon") is None
+    
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+    assert 15 < _parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 20
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+@pytest.mark.asyncio
+async def test_paddle_long_retry_after_capped():
+    """An HTTP-date Retry-After far in the future should be capped at MAX_DELAY."""
+    provider = PaddleProvider(api_key="test_key", webhook_secret="test_secret")
+    
+    mock_client = AsyncMock()
+    provider._client = mock_client
+    
+    retry_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    mock_resp_429 = MagicMock(spec=httpx.Response)
+    mock_resp_429.status_code = 429
+    mock_resp_429.headers = {"Retry-After": format_datetime(retry_at, usegmt=True)}
+    
+    mock_resp_200 = MagicMock(spec=httpx.Response)
+    mock_resp_200.status_code = 200
+    mock_resp_200.content = b'{"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}'
+    
+    mock_client.request.side_effect = [mock_resp_429, mock_resp_200]
+    
+    with patch("asyncio.sleep", AsyncMock()) as mock_sleep:
+        request = PaymentRequest(user_id=123, amount_usd=Decimal("10"), method=PaymentMethod.PADDLE)
+        await provider.create_checkout(request, "https://success", "https://cancel")
+        
+        mock_sleep.assert_called_with(PaddleProvider.MAX_DELAY)
+
+@pytest.mark.asyncio
+async def test_paddle_clients_shared_per_key():
+    """Providers with the same base URL and key should share one pooled client."""
+    from api.services.payment_engine import close_paddle_clients
+    
+    first = PaddleProvider(api_key="test_key", webhook_secret="test_secret")
+    second = PaddleProvider(api_key="test_key", webhook_secret="other_secret")
+    other = PaddleProvider(api_key="other_key", webhook_secret="test_secret")
+    
+    try:
+        client = await first._get_client()
+        assert await second._get_client() is client
+        assert await other._get_client() is not client
+    finally:
+        await close_paddle_clients()
+    assert client.is_closed
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_after_burst():
+    """A burst up to the rate passes straight through; the next request waits for a refill."""
+    bucket = _TokenBucket(50.0)
+    for _ in range(50):
+        await bucket.acquire()
+    
+    start = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.01
+
+def test_token_bucket_throttle_recovers():
+    """throttle() halves the rate, down to 1/s, until the cooldown passes."""
+    bucket = _TokenBucket(4.0, cooldown=60.0)
+    bucket.throttle()
+    assert bucket.rate == 2.0
+    bucket.throttle()
+    bucket.throttle()
+    assert bucket.rate == 1.0
+    
+    bucket._throttled_until = time.monotonic() - 1  # Cooldown elapsed
+    bucket._refill(time.monotonic())
+    assert bucket.rate == 4.0
+
 @pytest.mark.asyncio
 async def test_metrics_recording():
     """Test that metrics are recorded during checkout creation."""
@@ -70,7 +190,7 @@ async def test_metrics_recording():
     
     mock_resp_200 = MagicMock(spec=httpx.Response)
     mock_resp_200.status_code = 200
-    mock_resp_200.json.return_value = {"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}
+    mock_resp_200.content = b'{"data": {"id": "txn_123", "checkout": {"url": "https://test.com"}}}'
     mock_client.request.return_value = mock_resp_200
     
     # Get initial values if possible (might be tricky with global registry)
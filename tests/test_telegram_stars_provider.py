@@ -2,7 +2,7 @@
 
 import pytest
 from decimal import Decimal
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import json
 
 from api.services.payment_engine import (
@@ -19,10 +19,22 @@ from api.services.payment_engine import (
 # Fixtures
 # ============================================================================
 
+def mock_async_redis():
+    """Async Redis mock whose pipeline() returns an async context manager."""
+    mock_redis = MagicMock()
+    mock_redis.setex = AsyncMock()
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[None, 0])
+    pipe.__aenter__ = AsyncMock(return_value=pipe)
+    pipe.__aexit__ = AsyncMock(return_value=False)
+    mock_redis.pipeline.return_value = pipe
+    return mock_redis
+
+
 @pytest.fixture
 def stars_provider():
     """Create TelegramStarsProvider instance for testing."""
-    mock_redis = MagicMock()
+    mock_redis = mock_async_redis()
     return TelegramStarsProvider(
         bot_token="test_bot_token",
         redis_client=mock_redis,
@@ -74,6 +86,11 @@ class TestConversion:
         # Non-standard amount
         package = TelegramStarsProvider.get_package_for_usd(Decimal("7.50"))
         assert package is None
+    
+    def test_get_package_for_usd_normalizes_exponent(self):
+        """Amounts should match regardless of how many decimal places they carry."""
+        assert TelegramStarsProvider.get_package_for_usd(Decimal("5"))["stars"] == 250
+        assert TelegramStarsProvider.get_package_for_usd(Decimal("20.000"))["stars"] == 1000
 
 
 # ============================================================================
@@ -107,7 +124,7 @@ class TestCreateCheckout:
         )
         
         # Check Redis setex was called
-        stars_provider._redis.setex.assert_called_once()
+        stars_provider._redis.setex.assert_awaited_once()
         call_args = stars_provider._redis.setex.call_args
         key = call_args[0][0]
         ttl = call_args[0][1]
@@ -147,11 +164,12 @@ class TestProcessWebhook:
         payload = "topup:12345:1234567890:abcd1234"
         
         # Mock Redis with pending data
-        stars_provider._redis.get.return_value = json.dumps({
+        pipe = stars_provider._redis.pipeline.return_value
+        pipe.execute.return_value = [json.dumps({
             "user_id": 12345,
             "stars": 250,
             "usd": "5.00",
-        }).encode()
+        }), 1]
         
         event = WebhookEvent(
             provider=PaymentMethod.TELEGRAM_STARS,
@@ -175,11 +193,16 @@ class TestProcessWebhook:
         assert transaction.type == TransactionType.TOPUP
         assert transaction.source == "telegram_stars"
         assert transaction.external_id == "charge_123"
+        # Pending record read and cleared in a single pipeline
+        stars_provider._redis.pipeline.assert_called_once_with(transaction=False)
+        pipe.get.assert_called_once_with(f"pending_stars:{payload}")
+        pipe.delete.assert_called_once_with(f"pending_stars:{payload}")
+        pipe.execute.assert_awaited_once()
     
     @pytest.mark.asyncio
     async def test_process_payment_without_pending_data(self, stars_provider):
         """Test processing payment when pending data is missing."""
-        stars_provider._redis.get.return_value = None
+        stars_provider._redis.pipeline.return_value.execute.return_value = [None, 0]
         
         event = WebhookEvent(
             provider=PaymentMethod.TELEGRAM_STARS,
@@ -229,7 +252,7 @@ class TestGetPaymentStatus:
     @pytest.mark.asyncio
     async def test_get_status_pending(self, stars_provider):
         """Test getting status of pending payment."""
-        stars_provider._redis.exists.side_effect = lambda key: key.startswith("pending_stars:")
+        stars_provider._redis.pipeline.return_value.execute.return_value = [1, 0]
         
         status = await stars_provider.get_payment_status("topup:12345:123")
         assert status == PaymentStatus.PENDING
@@ -237,20 +260,20 @@ class TestGetPaymentStatus:
     @pytest.mark.asyncio
     async def test_get_status_completed(self, stars_provider):
         """Test getting status of completed payment."""
-        def check_exists(key):
-            if key.startswith("stars_processed:"):
-                return True
-            return False
-        
-        stars_provider._redis.exists.side_effect = check_exists
+        pipe = stars_provider._redis.pipeline.return_value
+        pipe.execute.return_value = [0, 1]
         
         status = await stars_provider.get_payment_status("topup:12345:123")
         assert status == PaymentStatus.COMPLETED
+        assert [c.args[0] for c in pipe.exists.call_args_list] == [
+            "pending_stars:topup:12345:123",
+            "stars_processed:topup:12345:123",
+        ]
     
     @pytest.mark.asyncio
     async def test_get_status_unknown(self, stars_provider):
         """Test getting status of unknown payment defaults to pending."""
-        stars_provider._redis.exists.return_value = False
+        stars_provider._redis.pipeline.return_value.execute.return_value = [0, 0]
         
         status = await stars_provider.get_payment_status("unknown")
         assert status == PaymentStatus.PENDING